@@ -0,0 +1,201 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import main
+
+# --- ค่าคงที่ ---
+SINGBURI_FIXTURE = "data/fixtures/singburi_wl.html"
+CHAOPRAYA_FIXTURE = "data/fixtures/chaopraya.php.html"
+BASELINE_PATH = "data/benchmark_baseline.json"
+REGRESSION_THRESHOLD = 0.25  # ช้ากว่า baseline เกิน 25% ถือว่าถดถอย
+# รายการที่ใช้เวลาระดับไมโครวินาทีแกว่งเกิน 25% ได้เองบนเครื่องที่มี CPU น้อย
+# จึงต้องช้าลงเกินค่านี้ (วินาทีต่อครั้ง) ด้วยจึงจะนับว่าถดถอย
+REGRESSION_FLOOR = 2e-6
+REPEAT = 15           # จำนวนรอบที่วัด (ใช้รอบที่เร็วที่สุด)
+MIN_ROUND_TIME = 0.1  # แต่ละรอบต้องยาวอย่างน้อยกี่วินาที (เพิ่มจำนวนครั้งต่อรอบอัตโนมัติ)
+BASELINE_RUNS = 3     # --save-baseline เก็บค่ามัธยฐานของหลายรอบ (ไม่ยึดรอบที่เครื่องบังเอิญเร็ว)
+CONFIRM_RUNS = 2      # รายการที่ดูเหมือนถดถอยจะถูกวัดซ้ำอีกกี่ครั้งก่อนตัดสินว่าไม่ผ่าน
+PARSERS = ["html.parser", "lxml"]
+
+def _timed(fn, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - started
+
+def _best_of_many(cases: dict, repeat: int = REPEAT, min_time: float = MIN_ROUND_TIME) -> dict[str, float]:
+    """
+    cases = {ชื่อ: (ฟังก์ชัน, จำนวนครั้งขั้นต่ำต่อรอบ)} คืนเวลาเฉลี่ยต่อครั้ง (วินาที) ของรอบที่เร็วที่สุดของแต่ละรายการ
+    รอบที่สั้นกว่า min_time จะเพิ่มจำนวนครั้งจนยาวพอ (แบบ timeit.autorange) แล้ววัดสลับกันทีละรายการ
+    รอบของแต่ละรายการจึงกระจายตลอดช่วงที่วัด ไม่กองอยู่ในช่วงที่เครื่องบังเอิญช้า
+    """
+    # ปิด print ของฟังก์ชันที่วัด เพื่อไม่ให้เวลา I/O ปนกับผลลัพธ์ และปิด GC ระหว่างวัดแบบเดียวกับ timeit
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            numbers, best = {}, {}
+            for name, (fn, number) in cases.items():
+                elapsed = _timed(fn, number)
+                while elapsed < min_time:
+                    number = max(number * 2, int(number * min_time * 1.2 / max(elapsed, 1e-9)))
+                    elapsed = _timed(fn, number)
+                numbers[name], best[name] = number, elapsed / number
+            for _ in range(repeat - 1):
+                for name, (fn, _) in cases.items():
+                    best[name] = min(best[name], _timed(fn, numbers[name]) / numbers[name])
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+def _best_of(fn, number: int, repeat: int = REPEAT, min_time: float = MIN_ROUND_TIME) -> float:
+    """คืนเวลาเฉลี่ยต่อครั้ง (วินาที) ของรอบที่เร็วที่สุด (ดู _best_of_many)"""
+    return _best_of_many({"": (fn, number)}, repeat, min_time)[""]
+
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+def bench_table_parsers(path: str = SINGBURI_FIXTURE, number: int = 200) -> dict[str, float]:
+    """เปรียบเทียบเวลาอ่านตารางสถานี (parse_station_table) ระหว่าง parser ของ BeautifulSoup"""
+    html = _read(path)
+    results = {}
+    for parser in PARSERS:
+        try:
+            main.parse_station_table(html, parser)
+        except Exception as e:
+            # เช่น ยังไม่ได้ติดตั้ง lxml
+            print(f"⚠️ ข้าม parser '{parser}': {e}")
+            continue
+        results[parser] = _best_of(lambda: main.parse_station_table(html, parser), number)
+    return results
+
+def _regex_c13(text: str):
+    # วิธีเดิม: regex แบบ greedy + json.loads แล้วเลือกเฉพาะ C13
+    match = re.search(r'var json_data = (\[.*\]);', text)
+    return json.loads(match.group(1))[0]['itc_water']['C13']['storage']
+
+def bench_json_data(path: str = CHAOPRAYA_FIXTURE, number: int = 500) -> dict[str, float]:
+    """เปรียบเทียบการอ่าน json_data แบบเดิม (regex) กับ parse_discharge_table"""
+    text = _read(path)
+    table = main.parse_discharge_table(text)
+    return {
+        "regex + json.loads (C13)": _best_of(lambda: _regex_c13(text), number),
+        "parse_discharge_table (ทุกสถานี)": _best_of(lambda: main.parse_discharge_table(text), number),
+        "DischargeTable.get (ต่อครั้ง)": _best_of(lambda: table.get("C13", "storage"), number * 100),
+    }
+
+def bench_pipeline(page: str = SINGBURI_FIXTURE, payload_path: str = CHAOPRAYA_FIXTURE,
+                   number: int = 200, only: set[str] | None = None) -> dict[str, float]:
+    """
+    วัดเวลาของ hot path หลักในไปป์ไลน์ โดยใช้ไฟล์ที่บันทึกไว้เท่านั้น (ไม่ใช้เครือข่าย)
+    ชื่อ key ใช้เป็น key ของ baseline ด้วย จึงไม่ควรเปลี่ยนโดยไม่จำเป็น
+    only จำกัดให้วัดเฉพาะบางรายการ (ใช้ตอนวัดซ้ำ)
+    """
+    html = _read(page)
+    payload = _read(payload_path)
+    files = main.find_historical_files()
+    index = main.HistoricalIndex.build(files)
+    trend = {"slope": 0.1, "rate": 0.12, "level": 10.5, "hours_to_bank": 20.0}
+    cases = {
+        "inburi_row_parse": (lambda: main.parse_inburi_html(html), number),
+        "dam_json_data_parse": (lambda: main.parse_discharge_table(payload).get("C13", "storage"), number),
+        "historical_index_build": (lambda: main.HistoricalIndex.build(files), 1),
+        "historical_lookup_all": (lambda: index.lookup_all(10, 17), number * 10),
+        "historical_from_excel": (lambda: main.get_historical_for_today(main.HIST_YEARS), number),
+        "analyze_and_create_message": (
+            lambda: main.analyze_and_create_message(10.5, 1850.0, 13.0, hist_2567=1451, hist_2565=3058,
+                                                    hist_2554=2100, trend=trend),
+            number,
+        ),
+    }
+    return _best_of_many({name: case for name, case in cases.items() if only is None or name in only})
+
+def load_baseline(path: str = BASELINE_PATH) -> dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_baseline(results: dict[str, float], path: str = BASELINE_PATH) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+def compare(results: dict[str, float], baseline: dict[str, float],
+            threshold: float = REGRESSION_THRESHOLD, floor: float = REGRESSION_FLOOR) -> list[str]:
+    """
+    พิมพ์ผลเทียบกับ baseline และคืนชื่อรายการที่ช้ากว่า baseline เกิน threshold
+    และช้าลงเกิน floor วินาทีต่อครั้ง (กันรายการเล็กมากที่แกว่งตามเครื่อง)
+    """
+    regressions = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"⏱️ {name}: {seconds * 1e6:.1f} µs (ยังไม่มี baseline)")
+            continue
+        change = seconds / base - 1
+        regressed = change > threshold and seconds - base > floor
+        flag = "❌" if regressed else "✅"
+        print(f"{flag} {name}: {seconds * 1e6:.1f} µs (baseline {base * 1e6:.1f} µs, {change:+.0%})")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="วัดความเร็วการอ่านข้อมูลและไปป์ไลน์จากไฟล์ที่บันทึกไว้ (ไม่ใช้เครือข่าย)")
+    cli.add_argument("--page", default=SINGBURI_FIXTURE, help="ไฟล์ HTML ของ singburi.thaiwater.net/wl")
+    cli.add_argument("--payload", default=CHAOPRAYA_FIXTURE, help="ไฟล์คำตอบของ chaopraya.php")
+    cli.add_argument("--number", type=int, default=200, help="จำนวนครั้งขั้นต่ำต่อรอบ")
+    cli.add_argument("--baseline", default=BASELINE_PATH, help="ไฟล์ baseline (JSON)")
+    cli.add_argument("--save-baseline", action="store_true", help="บันทึกผลรอบนี้เป็น baseline ใหม่")
+    cli.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="สัดส่วนที่ยอมให้ช้าลงได้ (0.25 = 25%%)")
+    cli.add_argument("--pipeline-only", action="store_true", help="วัดเฉพาะชุดที่เทียบกับ baseline")
+    args = cli.parse_args()
+
+    if not args.pipeline_only:
+        results = bench_table_parsers(args.page, args.number)
+        baseline = results.get("html.parser")
+        for parser, seconds in results.items():
+            speedup = f" (เร็วกว่า html.parser {baseline / seconds:.1f} เท่า)" if baseline and parser != "html.parser" else ""
+            print(f"⏱️ {parser}: {seconds * 1e6:.0f} µs ต่อหน้า{speedup}")
+
+        for name, seconds in bench_json_data(args.payload, args.number).items():
+            print(f"⏱️ {name}: {seconds * 1e6:.1f} µs")
+
+    print("\n=== ไปป์ไลน์ ===")
+    if (args.page, args.payload) != (SINGBURI_FIXTURE, CHAOPRAYA_FIXTURE) and not args.save_baseline:
+        print("⚠️ ใช้ไฟล์ต่างจาก fixture มาตรฐาน ผลเทียบกับ baseline อาจไม่ตรงกัน")
+    pipeline = bench_pipeline(args.page, args.payload, args.number)
+    if args.save_baseline:
+        runs = [pipeline] + [bench_pipeline(args.page, args.payload, args.number) for _ in range(BASELINE_RUNS - 1)]
+        pipeline = {name: statistics.median(run[name] for run in runs) for name in pipeline}
+        save_baseline(pipeline, args.baseline)
+        for name, seconds in pipeline.items():
+            print(f"⏱️ {name}: {seconds * 1e6:.1f} µs")
+        print(f"💾 บันทึก baseline ที่ {args.baseline}")
+        sys.exit(0)
+    baseline = load_baseline(args.baseline)
+    regressions = compare(pipeline, baseline, args.threshold)
+    for _ in range(CONFIRM_RUNS):
+        if not regressions:
+            break
+        # เครื่องอาจช้าลงชั่วคราวทั้งเครื่อง: วัดซ้ำเฉพาะรายการที่ไม่ผ่าน แล้วใช้ค่าที่ดีที่สุด
+        print(f"🔁 วัดซ้ำ: {', '.join(regressions)}")
+        again = bench_pipeline(args.page, args.payload, args.number, only=set(regressions))
+        retried = {name: min(pipeline[name], again[name]) for name in regressions}
+        pipeline.update(retried)
+        regressions = compare(retried, baseline, args.threshold)
+    if regressions:
+        print(f"❌ ช้ากว่า baseline เกิน {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
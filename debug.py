@@ -1,16 +1,22 @@
+import argparse
+import json
+import os
+import sys
+
 import requests
 from bs4 import BeautifulSoup
 
 # --- ค่าคงที่ ---
 # ลองกับเว็บข้อมูลเขื่อนที่ง่ายกว่าก่อน
 URL_TO_DEBUG = "https://tiwrm.hii.or.th/DATA/REPORT/php/chart/chaopraya/small/chaopraya.php"
+FIXTURE_DIR = os.path.join("data", "fixtures")
 
 def download_and_inspect_page(url):
     print(f"🕵️ กำลังดาวน์โหลดข้อมูลจาก: {url}")
     try:
         res = requests.get(url, timeout=30)
         res.raise_for_status()
-        
+
         # บันทึก HTML ทั้งหน้าลงไฟล์ เพื่อให้เราเปิดดูได้ง่ายๆ
         file_name = "debug_page.html"
         with open(file_name, "w", encoding="utf-8") as f:
@@ -21,5 +27,67 @@ def download_and_inspect_page(url):
     except Exception as e:
         print(f"❌ เกิดข้อผิดพลาดระหว่างดาวน์โหลด: {e}")
 
+def _fixture_sources():
+    import main
+
+    return [
+        ("singburi_wl.html", main.SINGBURI_URL),
+        ("singburi_wl.json", main.SINGBURI_JSON_URL),
+        ("chaopraya.php.html", main.DISCHARGE_URL),
+    ]
+
+def capture_fixtures(folder=FIXTURE_DIR):
+    """บันทึกคำตอบจริงของต้นทางทั้งสามเป็น fixture (ไบต์ตามที่ได้รับ ไม่แก้ไข)"""
+    import main
+
+    os.makedirs(folder, exist_ok=True)
+    for name, url in _fixture_sources():
+        if not url:
+            print(f"⏭️ ข้าม {name}: ไม่ได้กำหนด URL")
+            continue
+        print(f"🕵️ กำลังบันทึก {url} -> {name}")
+        res = requests.get(url, headers=main.HTTP_HEADERS, timeout=30)
+        res.raise_for_status()
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(res.content)
+        print(f"✅ {name}: {len(res.content):,} ไบต์")
+
+def check_fixtures(folder=FIXTURE_DIR):
+    """
+    ตรวจ parser กับ fixture แบบออฟไลน์: อินทร์บุรีต้องอ่านได้ทั้งจาก HTML และ JSON (และได้ค่าเดียวกัน)
+    และต้องอ่านปริมาณน้ำ C13 จาก chaopraya.php ได้ คืนค่าจำนวนข้อที่ไม่ผ่าน
+    """
+    import main
+
+    failures = 0
+
+    def report(ok, text):
+        nonlocal failures
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {text}")
+
+    with open(os.path.join(folder, "singburi_wl.html"), encoding="utf-8") as f:
+        from_html = main.parse_inburi_html(f.read())
+    report(None not in from_html, f"parse_inburi_html(singburi_wl.html) = {from_html}")
+    with open(os.path.join(folder, "singburi_wl.json"), encoding="utf-8") as f:
+        from_json = main.parse_inburi_json(json.load(f))
+    report(None not in from_json, f"parse_inburi_json(singburi_wl.json) = {from_json}")
+    if None not in from_html and None not in from_json:
+        report(from_html == from_json, "HTML และ JSON ให้ค่าอินทร์บุรีตรงกัน")
+    with open(os.path.join(folder, "chaopraya.php.html"), encoding="utf-8") as f:
+        table = main.parse_discharge_table(f.read())
+    discharge = table.get("C13", "storage") if table is not None else None
+    report(isinstance(discharge, float), f"parse_discharge_table(chaopraya.php.html) C13 = {discharge}")
+    return failures
+
 if __name__ == "__main__":
-    download_and_inspect_page(URL_TO_DEBUG)
+    parser = argparse.ArgumentParser(description="ดาวน์โหลด/ตรวจหน้าต้นทางเพื่อหาสาเหตุเมื่อ parser อ่านค่าไม่ได้")
+    parser.add_argument("--capture", action="store_true", help=f"บันทึกคำตอบจริงของต้นทางทั้งหมดลง {FIXTURE_DIR}")
+    parser.add_argument("--check", action="store_true", help=f"ตรวจ parser กับไฟล์ใน {FIXTURE_DIR} โดยไม่ออกเน็ต")
+    args = parser.parse_args()
+    if args.capture:
+        capture_fixtures()
+    if args.check:
+        sys.exit(1 if check_fixtures() else 0)
+    if not args.capture:
+        download_and_inspect_page(URL_TO_DEBUG)
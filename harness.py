@@ -0,0 +1,318 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# --- ค่าคงที่ ---
+SINGBURI_FIXTURE = "data/fixtures/singburi_wl.html"
+SINGBURI_JSON_FIXTURE = "data/fixtures/singburi_wl.json"
+CHAOPRAYA_FIXTURE = "data/fixtures/chaopraya.php.html"
+ENDPOINTS = ("singburi", "dam", "line", "make")
+FAULT_KINDS = ("latency", "jitter", "timeout", "429", "error", "malformed")
+SLA_SECONDS = 180.0  # ข้อความต้องถึงทุกปลายทางภายในกี่วินาทีนับจากเริ่มรัน main.py
+
+def parse_fault(spec: str) -> tuple[str, dict[str, float]]:
+    """
+    แปลง 'endpoint:kind=value,...' เช่น 'line:429=0.3,latency=0.2' หรือ 'dam:timeout=0.1'
+    latency/jitter เป็นวินาที ส่วน timeout/429/error/malformed เป็นความน่าจะเป็นต่อ request
+    """
+    endpoint, _, body = spec.partition(":")
+    if endpoint not in ENDPOINTS and endpoint != "all":
+        raise argparse.ArgumentTypeError(f"ไม่รู้จัก endpoint '{endpoint}' (ใช้ {', '.join(ENDPOINTS)} หรือ all)")
+    faults = {}
+    for item in filter(None, body.split(",")):
+        kind, _, value = item.partition("=")
+        if kind not in FAULT_KINDS:
+            raise argparse.ArgumentTypeError(f"ไม่รู้จักชนิด fault '{kind}' (ใช้ {', '.join(FAULT_KINDS)})")
+        faults[kind] = float(value)
+    return endpoint, faults
+
+class StandIn:
+    """
+    HTTP server ในเครื่องที่ทำหน้าที่แทนต้นทางทั้งสี่ (singburi JSON/HTML, chaopraya.php, LINE push, Make webhook)
+    ตอบด้วยไฟล์ที่บันทึกไว้ และสุ่มใส่ความหน่วง/timeout/429/5xx/ข้อมูลเสียตาม faults ของแต่ละ endpoint
+    """
+
+    def __init__(self, faults: dict[str, dict[str, float]], hang: float, seed: int | None = None,
+                 script: dict[str, list[str]] | None = None):
+        with open(SINGBURI_FIXTURE, "rb") as f:
+            self.singburi = f.read()
+        with open(SINGBURI_JSON_FIXTURE, "rb") as f:
+            self.singburi_json = f.read()
+        with open(CHAOPRAYA_FIXTURE, "rb") as f:
+            self.dam = f.read()
+        self.faults = faults
+        # ผลที่กำหนดไว้ล่วงหน้าต่อ endpoint (เช่น ["429", "ok"]) ใช้ก่อนการสุ่มเพื่อให้ตรวจซ้ำได้ผลเดิม
+        self.script = {endpoint: list(outcomes) for endpoint, outcomes in (script or {}).items()}
+        self.retry_keys: list[str | None] = []  # X-Line-Retry-Key ของทุก request ที่ส่งมายัง LINE
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.events: list[tuple[float, str, str]] = []  # (เวลา, endpoint, ผลลัพธ์)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> None:
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+    def _record(self, endpoint: str, outcome: str) -> None:
+        with self.lock:
+            self.events.append((time.time(), endpoint, outcome))
+
+    def _pick(self, endpoint: str) -> tuple[float, str | None]:
+        """สุ่มความหน่วงและ fault (ถ้ามี) สำหรับ request หนึ่งครั้ง"""
+        faults = self.faults.get(endpoint, {})
+        with self.lock:
+            delay = faults.get("latency", 0.0) + self.random.uniform(0, faults.get("jitter", 0.0))
+            if self.script.get(endpoint):
+                outcome = self.script[endpoint].pop(0)
+                return delay, None if outcome == "ok" else outcome
+            roll = self.random.random()
+        for kind in ("timeout", "429", "error", "malformed"):
+            roll -= faults.get(kind, 0.0)
+            if roll < 0:
+                return delay, kind
+        return delay, None
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes = b"", headers: dict | None = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _serve(self, endpoint: str, body: bytes, content_type: str):
+                delay, fault = standin._pick(endpoint)
+                time.sleep(delay)
+                if fault == "timeout":
+                    # ค้างไว้จนฝั่ง client หมดเวลา แล้วปิดการเชื่อมต่อโดยไม่ตอบ
+                    standin._record(endpoint, "timeout")
+                    time.sleep(standin.hang)
+                    self.close_connection = True
+                    return
+                if fault == "429":
+                    standin._record(endpoint, "429")
+                    self._reply(429, b'{"message":"rate limited"}', {"Retry-After": "1"})
+                    return
+                if fault == "error":
+                    standin._record(endpoint, "error")
+                    self._reply(503, b"service unavailable")
+                    return
+                if fault == "malformed":
+                    standin._record(endpoint, "malformed")
+                    # ตัดข้อมูลครึ่งหลังทิ้ง (ตาราง/JSON ไม่ครบ)
+                    self._reply(200, body[: len(body) // 2], {"Content-Type": content_type})
+                    return
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if endpoint == "dam" and self.headers.get("If-None-Match") == etag:
+                    standin._record(endpoint, "not_modified")
+                    self._reply(304, b"", {"ETag": etag})
+                    return
+                standin._record(endpoint, "ok")
+                self._reply(200, body, {"Content-Type": content_type, "ETag": etag})
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/wl":
+                    self._serve("singburi", standin.singburi, "text/html; charset=utf-8")
+                elif path == "/waterlevel_load":
+                    self._serve("singburi", standin.singburi_json, "application/json")
+                elif path == "/chaopraya.php":
+                    self._serve("dam", standin.dam, "text/html; charset=utf-8")
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = urlparse(self.path).path
+                if path == "/v2/bot/message/push":
+                    with standin.lock:
+                        standin.retry_keys.append(self.headers.get("X-Line-Retry-Key"))
+                    self._serve("line", b"{}", "application/json")
+                elif path.startswith("/make/"):
+                    self._serve("make", b"Accepted", "text/plain")
+                else:
+                    self._reply(404)
+
+        return Handler
+
+def run_once(standin: StandIn, env: dict, expected: int, timeout: float, verbose: bool = False) -> dict:
+    """รัน main.py หนึ่งครั้ง คืนเวลาจนข้อความถึงปลายทางครบ (inf หากไม่ครบ) และสรุป event ของ stand-in"""
+    mark = len(standin.events)
+    started = time.time()
+    try:
+        proc = subprocess.run([sys.executable, "main.py"], env=env, timeout=timeout,
+                              stdout=None if verbose else subprocess.DEVNULL,
+                              stderr=None if verbose else subprocess.PIPE)
+        exit_code = proc.returncode
+        if exit_code and proc.stderr:
+            print(proc.stderr.decode("utf-8", "replace")[-1000:], file=sys.stderr)
+    except subprocess.TimeoutExpired:
+        exit_code = None
+    finished = time.time()
+    with standin.lock:
+        events = standin.events[mark:]
+    delivered = [t for t, endpoint, outcome in events if endpoint in ("line", "make") and outcome == "ok"]
+    outcomes: dict[str, int] = {}
+    for _, endpoint, outcome in events:
+        key = f"{endpoint}:{outcome}"
+        outcomes[key] = outcomes.get(key, 0) + 1
+    return {
+        "delivery": max(delivered) - started if len(delivered) >= expected else float("inf"),
+        "delivered": len(delivered),
+        "wall": finished - started,
+        "exit_code": exit_code,
+        "outcomes": outcomes,
+    }
+
+def main_env(base: str, state_dir: str, groups: int, webhooks: int, run: int) -> dict:
+    # ค่าจาก shell ที่ชี้ไปยังต้นทาง/ปลายทางจริงต้องไม่หลุดเข้าไปในรอบที่วัด
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("METRICS_", "LINE_", "MAKE_"))}
+    env.update({
+        "SINGBURI_URL": f"{base}/wl",
+        "SINGBURI_JSON_URL": f"{base}/waterlevel_load",
+        "DISCHARGE_URL": f"{base}/chaopraya.php",
+        "LINE_PUSH_API_URL": f"{base}/v2/bot/message/push",
+        "LINE_CHANNEL_ACCESS_TOKEN": "harness",
+        "LINE_GROUP_IDS": ",".join(f"Charness{i}" for i in range(groups)),
+        "MAKE_WEBHOOK_URLS": ",".join(f"{base}/make/{i}" for i in range(webhooks)),
+        # ใช้ cache ของ HTTP และคลังข้อมูลร่วมกันทุกรอบเหมือนรันจริง แต่แยกคิวข้อความต่อรอบ
+        # เพื่อให้เวลาที่วัดเป็นของข้อความในรอบนั้นเท่านั้น
+        "HTTP_CACHE_PATH": os.path.join(state_dir, "http_cache.json"),
+        "OBSERVATION_DB": os.path.join(state_dir, "observations.sqlite3"),
+        "NOTIFY_QUEUE_PATH": os.path.join(state_dir, f"notify_queue_{run}.jsonl"),
+        # ไม่มีไฟล์นี้ใน state_dir จึงใช้ LINE_GROUP_IDS / MAKE_WEBHOOK_URLS ด้านบนเสมอ
+        # (ไม่หยิบ subscriptions.json ในโฟลเดอร์ที่รัน harness ซึ่งมีกลุ่ม LINE จริง)
+        "SUBSCRIPTIONS": os.path.join(state_dir, "subscriptions.json"),
+        "PYTHONIOENCODING": "utf-8",
+    })
+    return env
+
+def check_dispatch() -> int:
+    """
+    ตรวจ main.dispatch() กับ stand-in แบบกำหนดผลล่วงหน้า (ไม่สุ่ม): 429 พร้อม Retry-After, 503 แล้วสำเร็จ
+    และรายการที่ส่งไม่ทันต้องถูกเก็บในคิวแล้วส่งได้ในรอบถัดไปด้วย X-Line-Retry-Key เดิม คืนค่าจำนวนข้อที่ไม่ผ่าน
+    """
+    failures = 0
+
+    def report(ok, text):
+        nonlocal failures
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {text}")
+
+    standin = StandIn({}, hang=0.0, script={"line": ["429", "ok", "error", "error", "ok"], "make": ["error", "ok"]})
+    standin.start()
+    os.environ.update({"LINE_CHANNEL_ACCESS_TOKEN": "harness", "LINE_PUSH_API_URL": f"{standin.base}/v2/bot/message/push"})
+    import main
+
+    main.NOTIFY_BACKOFF = 0.05
+    try:
+        with tempfile.TemporaryDirectory(prefix="thai-water-dispatch-") as state_dir:
+            queue = os.path.join(state_dir, "notify_queue.jsonl")
+
+            started = time.monotonic()
+            counts = main.dispatch(main.line_deliveries("429", ["Ccheck"]), deadline=10, queue_path=queue)
+            elapsed = time.monotonic() - started
+            report(counts["sent"] == 1 and len(standin.retry_keys) == 2, f"LINE 429 แล้วสำเร็จ: {counts}")
+            report(elapsed >= 1.0, f"รอตาม Retry-After 1 วินาทีก่อนลองใหม่ ({elapsed:.2f} วินาที)")
+            report(standin.retry_keys[0] is not None and standin.retry_keys[0] == standin.retry_keys[1],
+                   "ส่งซ้ำด้วย X-Line-Retry-Key เดิม")
+
+            counts = main.dispatch(main.webhook_deliveries("503", urls=[f"{standin.base}/make/0"]),
+                                   deadline=10, queue_path=queue)
+            report(counts["sent"] == 1 and not os.path.exists(queue), f"Webhook 503 แล้วสำเร็จ: {counts}")
+
+            # 503 สองครั้งติดกันโดยมีเวลาให้ลองได้ครั้งเดียว: ต้องลงคิว แล้วรอบถัดไปส่งจากคิวสำเร็จ
+            counts = main.dispatch(main.line_deliveries("queued", ["Ccheck"]), deadline=0.01, queue_path=queue)
+            queued = main._load_queue(queue)
+            report(counts["failed"] == 1 and len(queued) == 1, f"ส่งไม่ทันแล้วเก็บลงคิว: {counts}, คิว {len(queued)} รายการ")
+            counts = main.dispatch([], deadline=10, queue_path=queue)
+            report(counts["sent"] == 1 and not os.path.exists(queue), f"รอบถัดไปส่งจากคิวสำเร็จ: {counts}")
+            keys = standin.retry_keys[2:]
+            report(bool(queued) and all(key == queued[0].get("retry_key") for key in keys),
+                   f"ทุกครั้งที่ลองส่งรายการในคิวใช้ X-Line-Retry-Key เดิม ({len(keys)} ครั้ง)")
+    finally:
+        standin.stop()
+    return failures
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="วัดเวลาตั้งแต่เริ่มรันจนแจ้งเตือนถึงปลายทาง โดยใช้ stand-in ในเครื่องแทนต้นทางจริงทั้งหมด")
+    cli.add_argument("--runs", type=int, default=20, help="จำนวนรอบที่รัน main.py")
+    cli.add_argument("--fault", action="append", type=parse_fault, default=[], metavar="ENDPOINT:KIND=VALUE,...",
+                     help="เช่น --fault line:429=0.3 --fault dam:timeout=0.1,latency=0.5 --fault all:jitter=0.2")
+    cli.add_argument("--hang", type=float, default=60.0, help="fault แบบ timeout จะค้างกี่วินาที")
+    cli.add_argument("--groups", type=int, default=2, help="จำนวนกลุ่ม LINE")
+    cli.add_argument("--webhooks", type=int, default=1, help="จำนวน Make webhook")
+    cli.add_argument("--sla", type=float, default=SLA_SECONDS, help="เวลาที่ยอมรับได้ (วินาที)")
+    cli.add_argument("--seed", type=int, default=None, help="seed ของการสุ่ม fault")
+    cli.add_argument("--results", metavar="JSONL", help="บันทึกผลแต่ละรอบเป็น JSON-lines")
+    cli.add_argument("--verbose", action="store_true", help="แสดง output ของ main.py")
+    cli.add_argument("--check-dispatch", action="store_true",
+                     help="ตรวจการลองใหม่/คิวของ dispatch() กับผลที่กำหนดไว้ล่วงหน้า แล้วจบ")
+    args = cli.parse_args()
+    if args.check_dispatch:
+        sys.exit(1 if check_dispatch() else 0)
+
+    faults: dict[str, dict[str, float]] = {}
+    for endpoint, spec in args.fault:
+        for name in ENDPOINTS if endpoint == "all" else (endpoint,):
+            faults.setdefault(name, {}).update(spec)
+
+    standin = StandIn(faults, args.hang, args.seed)
+    standin.start()
+    expected = args.groups + args.webhooks
+    results = []
+    with tempfile.TemporaryDirectory(prefix="thai-water-harness-") as state_dir:
+        out = open(args.results, "w", encoding="utf-8") if args.results else None
+        try:
+            for run in range(args.runs):
+                env = main_env(standin.base, state_dir, args.groups, args.webhooks, run)
+                result = run_once(standin, env, expected, timeout=args.sla * 3, verbose=args.verbose)
+                results.append(result)
+                mark = "✅" if result["delivery"] <= args.sla else "❌"
+                print(f"{mark} รอบ {run + 1}/{args.runs}: ส่งถึง {result['delivered']}/{expected} "
+                      f"ใน {result['delivery']:.2f} วินาที (รันทั้งหมด {result['wall']:.2f} วินาที)")
+                if out:
+                    out.write(json.dumps(dict(result, run=run, delivery=None if result["delivery"] == float("inf")
+                                              else round(result["delivery"], 6))) + "\n")
+        finally:
+            if out:
+                out.close()
+            standin.stop()
+
+    deliveries = [r["delivery"] for r in results]
+    met = sum(d <= args.sla for d in deliveries)
+    totals: dict[str, int] = {}
+    for r in results:
+        for key, n in r["outcomes"].items():
+            totals[key] = totals.get(key, 0) + n
+    # ใช้ nearest-rank ตัวเดียวกับ main.py: รันที่ส่งไม่ถึง (inf) ถูกนับรวมด้วย จึงสะท้อน SLA ตรงตามจริง
+    # (import ตรงนี้ เพราะ main อ่าน env ตอน import และ check_dispatch ต้องตั้ง env ก่อน)
+    from main import _percentile
+
+    print("\n=== สรุป ===")
+    print(f"⏱️ เวลาจนแจ้งเตือนถึงครบ: p50={_percentile(deliveries, 50):.2f}s p95={_percentile(deliveries, 95):.2f}s "
+          f"p99={_percentile(deliveries, 99):.2f}s max={max(deliveries):.2f}s")
+    print(f"🎯 อยู่ใน SLA {args.sla:.0f} วินาที: {met}/{len(results)} รอบ ({met / len(results):.0%})")
+    print(f"📊 request ที่ stand-in ได้รับ: {dict(sorted(totals.items()))}")
+    sys.exit(0 if met == len(results) else 1)
@@ -1,31 +1,223 @@
+from __future__ import annotations
+
+import time
+
+# เวลาเริ่ม import โมดูล ใช้วัดเวลาเริ่มระบบจนถึงการดึงข้อมูลครั้งแรก
+PROCESS_STARTED = time.perf_counter()
+
 import os
+import argparse
+import csv
 import re
 import json
-import time
+import hashlib
+import importlib.util
 import random
+import sqlite3
+import threading
+import uuid
 import requests
+from requests.adapters import HTTPAdapter
 import pytz
-import pandas as pd
-from datetime import datetime
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from math import ceil, inf, isfinite, isnan, nan as NAN
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+class _LazyModule:
+    """import โมดูลเมื่อใช้ครั้งแรก รอบที่ไม่ได้คำนวณแนวโน้ม/analogue จึงไม่เสียเวลาโหลด numpy ตอนเริ่มโปรแกรม"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = _LazyModule("numpy")
 
 # --- ค่าคงที่ ---
-SINGBURI_URL = "https://singburi.thaiwater.net/wl"
-DISCHARGE_URL = 'https://tiwrm.hii.or.th/DATA/REPORT/php/chart/chaopraya/small/chaopraya.php'
+# URL ต้นทางทั้งหมดเปลี่ยนได้ผ่านตัวแปรสภาพแวดล้อม (เช่น ชี้ไปยัง stand-in ของ harness.py)
+SINGBURI_URL = os.environ.get('SINGBURI_URL', "https://singburi.thaiwater.net/wl")
+DISCHARGE_URL = os.environ.get('DISCHARGE_URL', 'https://tiwrm.hii.or.th/DATA/REPORT/php/chart/chaopraya/small/chaopraya.php')
 LINE_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_GROUP_ID = os.environ.get('LINE_GROUP_ID') # Get Group ID from environment variable
-LINE_PUSH_API_URL = "https://api.line.me/v2/bot/message/push"
+# (ไม่บังคับ) หลายกลุ่มคั่นด้วย comma
+LINE_GROUP_IDS = [g.strip() for g in os.environ.get('LINE_GROUP_IDS', LINE_GROUP_ID or '').split(',') if g.strip()]
+LINE_PUSH_API_URL = os.environ.get('LINE_PUSH_API_URL', "https://api.line.me/v2/bot/message/push")
+# JSON สาธารณะของ thaiwater (ระดับน้ำล่าสุดทุกสถานีโทรมาตร) ที่ตาราง singburi.thaiwater.net/wl ใช้แสดงผล
+# ตั้งเป็นค่าว่างเพื่อข้ามไปอ่าน HTML ของ SINGBURI_URL โดยตรง
+SINGBURI_JSON_URL = os.environ.get(
+    'SINGBURI_JSON_URL', "https://api-v3.thaiwater.net/api/v1/thaiwater30/public/waterlevel_load"
+) or None
+
+# กำหนดเวลา (วินาที) ของขั้นตอนดึงข้อมูล นับจากเวลาเริ่มดึงพร้อมกัน
+ACQUIRE_DEADLINE = float(os.environ.get('ACQUIRE_DEADLINE', '150'))
+SOURCE_DEADLINES = {
+    "inburi": float(os.environ.get('INBURI_DEADLINE', '120')),
+    "dam": float(os.environ.get('DAM_DEADLINE', '30')),
+    "historical": float(os.environ.get('HISTORICAL_DEADLINE', '30')),
+}
+HIST_YEARS = (2567, 2565, 2554)
+# เวลารอตาราง (วินาที) และจำนวนครั้งที่ลองใหม่ของเส้นทาง Selenium
+INBURI_TIMEOUT = float(os.environ.get('INBURI_TIMEOUT', '45'))
+INBURI_RETRIES = int(os.environ.get('INBURI_RETRIES', '3'))
 
 # URL สำหรับ Webhook ของ Make.com (กำหนดผ่านตัวแปรสภาพแวดล้อม)
 MAKE_WEBHOOK_URL = os.environ.get('MAKE_WEBHOOK_URL')
+MAKE_WEBHOOK_URLS = [u.strip() for u in os.environ.get('MAKE_WEBHOOK_URLS', MAKE_WEBHOOK_URL or '').split(',') if u.strip()]
+
+# --- วัดเวลาแต่ละขั้นตอนและส่งออก metrics ---
+# กำหนด path อย่างน้อยหนึ่งตัวเพื่อเปิดใช้งาน หากไม่กำหนด span()/count() จะไม่ทำอะไรเลย
+METRICS_JSONL = os.environ.get('METRICS_JSONL')  # event แบบ JSON-lines (ต่อท้ายไฟล์ข้ามรอบ)
+METRICS_PROM = os.environ.get('METRICS_PROM')    # Prometheus textfile ของรอบล่าสุด
+METRICS_ENABLED = bool(METRICS_JSONL or METRICS_PROM)
+METRICS_PREFIX = "thai_water"
+
+_metrics_lock = threading.Lock()
+_span_stats: dict[str, list[float]] = {}            # ชื่อขั้นตอน -> [count, sum, max]
+_counters: dict[tuple[str, tuple], float] = {}     # (ชื่อ, labels) -> ค่า
+_metrics_file = None
+
+def _emit(event: dict) -> None:
+    global _metrics_file
+    if not METRICS_JSONL:
+        return
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    with _metrics_lock:
+        if _metrics_file is None:
+            _metrics_file = open(METRICS_JSONL, "a", encoding="utf-8")
+        _metrics_file.write(line)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("name", "attrs", "started")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        with _metrics_lock:
+            stats = _span_stats.setdefault(self.name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+        event = {"ts": time.time(), "type": "span", "name": self.name, "duration": round(duration, 6)}
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+        if self.attrs:
+            event.update(self.attrs)
+        _emit(event)
+        return False
+
+    def set(self, **attrs) -> None:
+        """เพิ่มข้อมูลประกอบให้ event ของ span นี้ (เช่น path ที่ใช้, จำนวน byte)"""
+        self.attrs.update(attrs)
+
+def span(name: str, **attrs):
+    """จับเวลาขั้นตอน: `with span("dam.fetch") as sp: ...`"""
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """เพิ่มค่า counter เช่น count("bytes_downloaded", len(body), source="dam")"""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def _prom_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def write_metrics() -> None:
+    """เขียน Prometheus textfile (หากกำหนด METRICS_PROM) และ event สรุป counter ลง JSON-lines"""
+    if not METRICS_ENABLED:
+        return
+    with _metrics_lock:
+        spans = {name: list(stats) for name, stats in _span_stats.items()}
+        counters = dict(_counters)
+    _emit({"ts": time.time(), "type": "counters",
+           "values": {name + _prom_labels(labels): value for (name, labels), value in counters.items()}})
+    if METRICS_JSONL and _metrics_file is not None:
+        _metrics_file.flush()
+    if not METRICS_PROM:
+        return
+    lines = [
+        f"# HELP {METRICS_PREFIX}_stage_duration_seconds เวลาที่ใช้ในแต่ละขั้นตอน",
+        f"# TYPE {METRICS_PREFIX}_stage_duration_seconds summary",
+    ]
+    for name, (n, total, _max) in sorted(spans.items()):
+        lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+        lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_count{{stage="{name}"}} {n}')
+    lines.append(f"# TYPE {METRICS_PREFIX}_stage_duration_seconds_max gauge")
+    for name, (_n, _total, longest) in sorted(spans.items()):
+        lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_max{{stage="{name}"}} {longest:.6f}')
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{METRICS_PREFIX}_{name}_total{_prom_labels(labels)} {value:g}")
+    lines.append(f"# TYPE {METRICS_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}_last_run_timestamp_seconds {time.time():.0f}")
+    tmp_path = f"{METRICS_PROM}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, METRICS_PROM)
+
+def summarize_metrics(path: str) -> dict[str, dict[str, float]]:
+    """อ่าน JSON-lines ของทุกรอบแล้วคำนวณ p50/p95/p99 ของเวลาแต่ละขั้นตอน"""
+    durations: dict[str, list[float]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if event.get("type") == "span":
+                durations.setdefault(event["name"], []).append(event["duration"])
+    summary = {}
+    for name, values in sorted(durations.items()):
+        summary[name] = {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": max(values),
+        }
+    return summary
 
 # -- อ่านข้อมูลย้อนหลังจาก Excel --
 THAI_MONTHS = {
@@ -33,222 +225,1298 @@ THAI_MONTHS = {
     'พฤษภาคม':5, 'มิถุนายน':6, 'กรกฎาคม':7, 'สิงหาคม':8,
     'กันยายน':9, 'ตุลาคม':10, 'พฤศจิกายน':11, 'ธันวาคม':12
 }
-def get_historical_from_excel(year_be: int) -> int | None:
-    """
-    อ่านไฟล์ระดับน้ำปี {year_be} จากทั้งโฟลเดอร์ data/ และโฟลเดอร์ปัจจุบัน
-    คืนค่า discharge (ลบ.ม./วิ) ของวัน–เดือนปัจจุบัน (ตามเขตเวลาเอเชีย/กรุงเทพ)
+HISTORICAL_DIRS = ["data", ".", "/mnt/data"]
+HISTORICAL_CACHE_PATH = "data/historical_index.bin"
+HISTORICAL_MISSING = -1
+# ดัชนีวันในปีแบบ 366 วัน (รวม 29 ก.พ.) เพื่อให้ทุกปีใช้ตำแหน่งเดียวกัน
+_DAY_OFFSETS = [0, 0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335]
 
-    รองรับหลายรูปแบบคอลัมน์ เช่น:
-      - มีคอลัมน์ 'เดือน' (ชื่อเดือนภาษาไทย) และ 'วันที่' (ตัวเลข) และคอลัมน์ปริมาณน้ำเป็น 'ปริมาณน้ำ (ลบ.ม./วินาที)' หรือ 'ปริมาณน้ำ (ลบ.ม./วิ)'
-      - มีคอลัมน์ 'วันที่' เป็นชนิด datetime และคอลัมน์ค่าปริมาณน้ำอื่น ๆ (เช่น 'ค่า (ปี 2022)')
-    """
-    import pandas as pd
-    # ค้นหาไฟล์ตามชื่อ
-    possible_paths = [f"data/ระดับน้ำปี{year_be}.xlsx", f"ระดับน้ำปี{year_be}.xlsx", f"/mnt/data/ระดับน้ำปี{year_be}.xlsx"]
-    file_path = None
-    for p in possible_paths:
-        if os.path.exists(p):
-            file_path = p
-            break
-    if file_path is None:
-        print(f"⚠️ ไม่พบไฟล์ข้อมูลย้อนหลังปี {year_be} ใน {possible_paths}")
-        return None
+def day_of_year_index(month: int, day: int) -> int:
+    """แปลง (เดือน, วัน) เป็นตำแหน่ง 0..365 ในปฏิทิน 366 วัน"""
+    return _DAY_OFFSETS[month] + day - 1
+
+def find_historical_files() -> dict[int, str]:
+    """ค้นหาไฟล์ ระดับน้ำปี{ปี}.xlsx ทั้งหมด คืนค่า {ปี พ.ศ.: path} (โฟลเดอร์แรกที่พบมีสิทธิ์ก่อน)"""
+    files: dict[int, str] = {}
+    for folder in HISTORICAL_DIRS:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            m = re.fullmatch(r"ระดับน้ำปี(\d{4})\.xlsx", name)
+            if m and int(m.group(1)) not in files:
+                files[int(m.group(1))] = os.path.join(folder, name)
+    return files
+
+def _to_int(val) -> int | None:
+    # แปลงเป็นตัวเลข int หากจำเป็น (รองรับค่าที่มี comma)
     try:
-        df = pd.read_excel(file_path)
-        # หาคอลัมน์ค่าปริมาณน้ำที่อาจจะมีหลายชื่อ
-        discharge_col = None
-        for col in df.columns:
-            name = str(col)
-            if 'ลบ.ม.' in name or 'discharge' in name or 'ค่า' in name:
-                discharge_col = col
-                break
-        if discharge_col is None:
-            print(f"⚠️ ไฟล์ {file_path} ไม่มีคอลัมน์ปริมาณน้ำที่รู้จัก")
+        return int(val)
+    except Exception:
+        try:
+            return int(str(val).replace(',', ''))
+        except Exception:
             return None
-        df = df.rename(columns={discharge_col: 'discharge'})
-        # ตรวจว่าเรามีคอลัมน์ 'เดือน' และ 'วันที่' แยกหรือไม่
-        if 'เดือน' in df.columns and 'วันที่' in df.columns:
-            # กรณีนี้ 'วันที่' เป็นตัวเลข (ไม่ใช่ datetime) และ 'เดือน' เป็นชื่อภาษาไทย
-            df['month_num'] = df['เดือน'].map(THAI_MONTHS)
-            df['day_num'] = df['วันที่']
-        elif 'วันที่' in df.columns:
-            # แปลง 'วันที่' ให้เป็น datetime หากไม่ใช่
-            if not pd.api.types.is_datetime64_any_dtype(df['วันที่']):
-                df['date'] = pd.to_datetime(df['วันที่'], errors='coerce')
+
+_YEAR_RE = re.compile(r"(\d{4})")
+_DATE_COLUMNS = ('วันที่', 'datetime', 'date', 'time', 'เวลา')
+
+def _ce_year(year: int) -> int:
+    # ไฟล์ส่วนใหญ่ใช้ปี พ.ศ. บางไฟล์ใช้ ค.ศ.
+    return year - 543 if year > 2400 else year
+
+def _iter_sheet_rows(path: str):
+    """อ่านไฟล์ทีละแถวโดยไม่โหลดทั้งไฟล์: .csv ด้วยโมดูล csv, .xlsx ด้วย openpyxl แบบ read-only"""
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            yield from csv.reader(f)
+        return
+    from openpyxl import load_workbook  # import เฉพาะตอนอ่าน Excel
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _archive_value(val) -> float | None:
+    if val is None or isinstance(val, bool):
+        return None
+    if isinstance(val, (int, float)):
+        return None if isnan(val) else float(val)
+    return _cell_number(str(val))
+
+def _archive_date(val) -> datetime | None:
+    """แปลงค่าในคอลัมน์วันที่เป็น datetime (รองรับ datetime ของ Excel, ISO และ วัน/เดือน/ปี)"""
+    if isinstance(val, datetime):
+        return val
+    text = str(val or '').strip()
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in ('%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _archive_time(year, month, day, hour=0, minute=0) -> datetime | None:
+    try:
+        return datetime(_ce_year(int(float(year))), int(month), int(day), int(hour), int(minute))
+    except (TypeError, ValueError):
+        return None
+
+def iter_discharge_records(path: str):
+    """
+    อ่านไฟล์ข้อมูลปริมาณน้ำย้อนหลัง (.xlsx/.csv) ทีละแถว คืนค่า (datetime ตามเวลาไทย, ลบ.ม./วินาที)
+
+    รองรับหลายรูปแบบคอลัมน์ เช่น:
+      - 'วันที่' (ตัวเลข) + 'เดือน' (ชื่อเดือนภาษาไทย) + 'ปี' (ไม่บังคับ) + คอลัมน์ปริมาณน้ำ ('ปริมาณน้ำ (ลบ.ม./วินาที)')
+      - 'วันที่' หรือ 'datetime' เป็นวันเวลา (รายวันหรือรายชั่วโมง) + คอลัมน์ค่า (เช่น 'ค่า (ปี 2022)')
+      - 'day_month' + หนึ่งคอลัมน์ต่อปี พ.ศ. (แบบ historical_comparison_*.csv)
+    ปีที่ระบุในชื่อคอลัมน์ค่าหรือชื่อไฟล์ ระดับน้ำปี{ปี}.xlsx มีสิทธิ์ก่อนปีในคอลัมน์วันที่
+    """
+    rows = _iter_sheet_rows(path)
+    header = next((row for row in rows if any(cell not in (None, '') for cell in row)), None)
+    if header is None:
+        return
+    names = [str(cell).strip() if cell is not None else '' for cell in header]
+
+    if names[0] == 'day_month':
+        years = [_to_int(name) for name in names[1:]]
+        for row in rows:
+            if not row or not row[0]:
+                continue
+            # Excel อาจแปลง 'DD-MM' เป็นวันที่ไปแล้ว ส่วนแถวที่ไม่ใช่รูปแบบนี้ (หมายเหตุ/สรุปท้ายตาราง) ให้ข้าม
+            if isinstance(row[0], datetime):
+                day, month = row[0].day, row[0].month
             else:
-                df['date'] = df['วันที่']
-            df['month_num'] = df['date'].dt.month
-            df['day_num'] = df['date'].dt.day
-        else:
-            print(f"⚠️ ไฟล์ {file_path} ไม่มีคอลัมน์ 'วันที่' ที่คาดหวัง")
+                parts = str(row[0]).strip().split('-')
+                if len(parts) != 2:
+                    continue
+                day, month = parts
+            for year, raw in zip(years, row[1:]):
+                value = _archive_value(raw)
+                when = _archive_time(year, month, day) if year is not None else None
+                if value is not None and when is not None:
+                    yield when, value
+        return
+
+    i_value = next((i for i, name in enumerate(names) if 'ลบ.ม.' in name or 'discharge' in name or 'ค่า' in name), None)
+    if i_value is None:
+        print(f"⚠️ ไฟล์ {path} ไม่มีคอลัมน์ปริมาณน้ำที่รู้จัก")
+        return
+    hint = _YEAR_RE.search(names[i_value]) or re.search(r"ระดับน้ำปี(\d{4})", os.path.basename(path))
+    year_hint = int(hint.group(1)) if hint else None
+
+    if 'เดือน' in names and 'วันที่' in names:
+        # 'วันที่' เป็นตัวเลขวันของเดือน และ 'เดือน' เป็นชื่อภาษาไทย
+        i_day, i_month = names.index('วันที่'), names.index('เดือน')
+        i_year = names.index('ปี') if 'ปี' in names else None
+        width = max(i_day, i_month, i_value, i_year or 0) + 1
+        for row in rows:
+            # ข้ามบรรทัดว่างหรือแถวที่มีคอลัมน์ไม่ครบ
+            if not row or len(row) < width:
+                continue
+            month = THAI_MONTHS.get(str(row[i_month] or '').strip()) or _to_int(row[i_month])
+            year = row[i_year] if i_year is not None and row[i_year] not in (None, '') else year_hint
+            day = _archive_value(row[i_day])
+            value = _archive_value(row[i_value])
+            when = _archive_time(year, month, day) if month and day and year else None
+            if value is not None and when is not None:
+                yield when, value
+        return
+
+    i_date = next((names.index(name) for name in _DATE_COLUMNS if name in names), None)
+    if i_date is None:
+        i_date = next((i for i, name in enumerate(names) if name.lower() in _DATE_COLUMNS), None)
+    if i_date is None:
+        print(f"⚠️ ไฟล์ {path} ไม่มีคอลัมน์ 'วันที่' ที่คาดหวัง")
+        return
+    width = max(i_date, i_value) + 1
+    for row in rows:
+        if not row or len(row) < width:
+            continue
+        when = _archive_date(row[i_date])
+        value = _archive_value(row[i_value])
+        if when is None or value is None:
+            continue
+        year = year_hint or when.year
+        when = _archive_time(year, when.month, when.day, when.hour, when.minute)
+        if when is not None:
+            yield when, value
+
+def read_discharge_rows(file_path: str) -> list[tuple[int, int, int]]:
+    """อ่านไฟล์ Excel ระดับน้ำหนึ่งปี คืนค่าลิสต์ (เดือน, วัน, discharge) ดู iter_discharge_records"""
+    rows = []
+    for when, value in iter_discharge_records(file_path):
+        rows.append((when.month, when.day, int(value)))
+    return rows
+
+class HistoricalIndex:
+    """
+    ตาราง discharge ย้อนหลังแบบกะทัดรัด: array int32 ขนาด (จำนวนปี x 366)
+    ค้นค่าของวันใดก็ได้ด้วยการคำนวณตำแหน่งเพียงครั้งเดียว (O(1))
+    บันทึกลงไฟล์ไบนารีพร้อมลายนิ้วมือของไฟล์ต้นทาง (mtime/size/sha1) เพื่อตรวจว่าต้องสร้างใหม่หรือไม่
+    """
+    __slots__ = ("years", "sources", "values", "_row", "dirty")
+
+    def __init__(self, years: list[int], sources: dict, values: array):
+        self.years = years
+        self.sources = sources
+        self.values = values
+        self._row = {year: i * 366 for i, year in enumerate(years)}
+        # True เมื่อ is_fresh ปรับลายนิ้วมือ (mtime) ใหม่แล้วและควรบันทึก cache ซ้ำ
+        self.dirty = False
+
+    def lookup(self, year_be: int, month: int, day: int) -> int | None:
+        row = self._row.get(year_be)
+        if row is None:
             return None
-        # วันที่วันนี้
-        now = datetime.now(pytz.timezone('Asia/Bangkok'))
-        today_d = now.day
-        today_m = now.month
-        match = df[(df['day_num'] == today_d) & (df['month_num'] == today_m)]
-        if not match.empty:
-            val = match.iloc[0]['discharge']
-            # แปลงเป็นตัวเลข int หากจำเป็น
+        val = self.values[row + day_of_year_index(month, day)]
+        return None if val == HISTORICAL_MISSING else val
+
+    def lookup_all(self, month: int, day: int) -> dict[int, int | None]:
+        """คืนค่าของวัน–เดือนที่ระบุสำหรับทุกปีในดัชนี"""
+        offset = day_of_year_index(month, day)
+        values = self.values
+        return {
+            year: (None if values[row + offset] == HISTORICAL_MISSING else values[row + offset])
+            for year, row in self._row.items()
+        }
+
+    @classmethod
+    def build(cls, files: dict[int, str]) -> "HistoricalIndex":
+        years = sorted(files)
+        values = array('i', [HISTORICAL_MISSING]) * (366 * len(years))
+        sources = {}
+        for i, year in enumerate(years):
+            path = files[year]
+            fingerprint = _file_fingerprint(path, with_hash=True)
             try:
-                # หากมี comma
-                val_int = int(val)
-            except Exception:
-                try:
-                    val_int = int(str(val).replace(',', ''))
-                except Exception:
-                    val_int = None
-            if val_int is not None:
-                print(f"✅ พบข้อมูลย้อนหลังสำหรับปี {year_be}: {val_int} ลบ.ม./วินาที (ไฟล์: {file_path})")
-                return val_int
-        print(f"⚠️ ไม่พบข้อมูลสำหรับวันที่ {today_d}/{today_m} ในไฟล์ปี {year_be} (ไฟล์: {file_path})")
-        return None
+                rows = read_discharge_rows(path)
+            except Exception as e:
+                # เก็บลายนิ้วมือพร้อมเครื่องหมาย error: ปีนี้ว่าง และจะอ่านใหม่เมื่อไฟล์เปลี่ยนเท่านั้น
+                print(f"❌ ERROR: ไม่สามารถโหลดข้อมูลย้อนหลังจาก Excel ได้ ({path}): {e}")
+                sources[str(year)] = dict(fingerprint, error=str(e))
+                continue
+            sources[str(year)] = fingerprint
+            # แถวแรกของแต่ละวันมีสิทธิ์ก่อน (เหมือนการเลือก match.iloc[0] เดิม)
+            for month, day, val in reversed(rows or []):
+                values[i * 366 + day_of_year_index(month, day)] = val
+        return cls(years, sources, values)
+
+    def save(self, path: str) -> None:
+        header = json.dumps({"years": self.years, "sources": self.sources}, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            self.values.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "HistoricalIndex":
+        with open(path, "rb") as f:
+            size = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(size).decode("utf-8"))
+            values = array('i')
+            values.frombytes(f.read())
+        return cls(header["years"], header["sources"], values)
+
+    def is_fresh(self, files: dict[int, str]) -> bool:
+        """ตรวจว่าไฟล์ต้นทางยังตรงกับดัชนี (เทียบ mtime/size ก่อน แล้วจึงเทียบ sha1 หากต่างกัน)"""
+        if sorted(files) != self.years:
+            return False
+        for year, path in files.items():
+            cached = self.sources.get(str(year), {})
+            current = _file_fingerprint(path)
+            if cached.get("path") != path or cached.get("size") != current["size"]:
+                return False
+            if cached.get("mtime_ns") != current["mtime_ns"]:
+                # เช่น หลัง git checkout ที่ mtime เปลี่ยนแต่เนื้อหาเหมือนเดิม: จำ mtime ใหม่ไว้ไม่ต้อง hash ซ้ำทุกรอบ
+                fingerprint = _file_fingerprint(path, with_hash=True)
+                if cached.get("sha1") != fingerprint["sha1"]:
+                    return False
+                self.sources[str(year)] = fingerprint
+                self.dirty = True
+        return True
+
+def _file_fingerprint(path: str, with_hash: bool = False) -> dict:
+    st = os.stat(path)
+    fp = {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        fp["sha1"] = _file_sha1(path)
+    return fp
+
+def _file_sha1(path: str, chunk_size: int = 1 << 20) -> str:
+    # อ่านทีละ 1 MB เพื่อไม่ให้ไฟล์ขนาดใหญ่ต้องอยู่ในหน่วยความจำทั้งก้อน
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+_historical_index: HistoricalIndex | None = None
+
+def get_historical_index(cache_path: str = HISTORICAL_CACHE_PATH) -> HistoricalIndex:
+    """
+    คืนค่าดัชนีข้อมูลย้อนหลัง: ใช้ไฟล์ cache หากยังไม่หมดอายุ
+    มิฉะนั้นอ่านไฟล์ Excel ทุกปีในรอบเดียวแล้วบันทึก cache ใหม่
+    """
+    global _historical_index
+    files = find_historical_files()
+    index = None
+    if _historical_index is not None and _historical_index.is_fresh(files):
+        index = _historical_index
+    elif os.path.exists(cache_path):
+        try:
+            index = HistoricalIndex.load(cache_path)
+            if not index.is_fresh(files):
+                index = None
+        except Exception as e:
+            print(f"⚠️ อ่านไฟล์ cache ข้อมูลย้อนหลังไม่ได้ ({cache_path}): {e}")
+            index = None
+    if index is None:
+        print(f"🔧 สร้างดัชนีข้อมูลย้อนหลังใหม่จาก {len(files)} ไฟล์...")
+        with span("historical.index_build", files=len(files)):
+            index = HistoricalIndex.build(files)
+        index.dirty = True
+    if index.dirty:
+        try:
+            index.save(cache_path)
+            index.dirty = False
+        except OSError as e:
+            print(f"⚠️ บันทึกไฟล์ cache ข้อมูลย้อนหลังไม่ได้ ({cache_path}): {e}")
+    _historical_index = index
+    return index
+
+def get_historical_for_today(years: tuple[int, ...] = HIST_YEARS) -> dict[int, int | None]:
+    """
+    คืนค่า discharge (ลบ.ม./วิ) ของวัน–เดือนปัจจุบัน (เขตเวลาเอเชีย/กรุงเทพ) ของทุกปีใน years
+    โหลด/ตรวจดัชนีครั้งเดียวแล้วอ่านทุกปีด้วย lookup_all (ดู get_historical_index)
+    """
+    try:
+        index = get_historical_index()
     except Exception as e:
-        print(f"❌ ERROR: ไม่สามารถโหลดข้อมูลย้อนหลังจาก Excel ได้ ({file_path}): {e}")
-        return None
+        print(f"❌ ERROR: ไม่สามารถโหลดข้อมูลย้อนหลังจาก Excel ได้: {e}")
+        return {year: None for year in years}
+    now = datetime.now(pytz.timezone('Asia/Bangkok'))
+    values = index.lookup_all(now.month, now.day)
+    result = {}
+    for year_be in years:
+        result[year_be] = None
+        if year_be not in values:
+            print(f"⚠️ ไม่พบไฟล์ข้อมูลย้อนหลังปี {year_be} ใน {HISTORICAL_DIRS}")
+            continue
+        source = index.sources.get(str(year_be), {})
+        file_path = source.get("path")
+        if source.get("error"):
+            print(f"⚠️ ไฟล์ข้อมูลย้อนหลังปี {year_be} อ่านไม่ได้ ({file_path}): {source['error']}")
+        elif values[year_be] is None:
+            print(f"⚠️ ไม่พบข้อมูลสำหรับวันที่ {now.day}/{now.month} ในไฟล์ปี {year_be} (ไฟล์: {file_path})")
+        else:
+            print(f"✅ พบข้อมูลย้อนหลังสำหรับปี {year_be}: {values[year_be]} ลบ.ม./วินาที (ไฟล์: {file_path})")
+            result[year_be] = values[year_be]
+    return result
+
+def get_historical_from_excel(year_be: int) -> int | None:
+    """ค่าของวัน–เดือนปัจจุบันของปี {year_be} ปีเดียว (ดู get_historical_for_today)"""
+    return get_historical_for_today((year_be,))[year_be]
 
 # --- ดึงระดับน้ำอินทร์บุรี ---
-def get_inburi_data(url: str, timeout: int = 45, retries: int = 3):
+INBURI_STATION_NAME = "อินทร์บุรี"
+INBURI_BANK_LEVEL = 13.0  # ระดับตลิ่งอินทร์บุรี (ม.รทก.) ใช้เมื่อตารางไม่มีค่าตลิ่ง
+# ใช้ lxml (เร็วกว่า) หากติดตั้งไว้ มิฉะนั้นใช้ html.parser ของ Python
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+}
+
+# Session เดียวสำหรับทุก request เพื่อใช้การเชื่อมต่อ (keep-alive/TLS) ซ้ำ โดยเฉพาะในโหมด daemon
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+http_session.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# ข้อมูลว่ารอบล่าสุดใช้เส้นทางไหน (http-json / http-html / selenium) และใช้เวลาเท่าไร
+last_inburi_fetch: dict = {"path": None, "elapsed": None}
+
+# โหมด daemon: เก็บ Chrome ไว้ใช้ซ้ำข้ามรอบแทนการเปิด/ปิดทุกครั้ง
+KEEP_DRIVER = False
+_shared_driver = None
+# ถือไว้ตลอดการดึงที่ใช้ _shared_driver: การดึงที่เกินกำหนดเวลาอาจยังทำงานอยู่ใน thread ของรอบก่อน
+# รอบถัดไปจึงต้องไม่หยิบ driver ตัวเดียวกันไปใช้พร้อมกัน
+_shared_driver_lock = threading.Lock()
+# ทรัพยากรที่ไม่จำเป็นต่อการอ่านตาราง (รูป ฟอนต์ CSS สื่อ และสคริปต์วิเคราะห์) ไม่ต้องให้ Chrome โหลด
+SELENIUM_BLOCKED_URLS = [u.strip() for u in os.environ.get(
+    'SELENIUM_BLOCKED_URLS',
+    '*.png,*.jpg,*.jpeg,*.gif,*.webp,*.svg,*.ico,*.woff,*.woff2,*.ttf,*.otf,*.css,*.mp4,'
+    '*google-analytics.com*,*googletagmanager.com*,*facebook.net*,*doubleclick.net*',
+).split(',') if u.strip()]
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+def _numeric_cells(texts) -> list[float]:
+    """แปลงข้อความในเซลล์ตารางเป็นตัวเลข ข้ามเซลล์ที่ไม่ใช่ตัวเลข"""
+    values: list[float] = []
+    for text in texts:
+        # ลบ comma ออก แล้วหยิบตัวเลขชุดแรก (ไม่สนหน่วยต่อท้าย เช่น “ม.”)
+        match = _NUMBER_RE.search(text.replace(",", ""))
+        if match:
+            values.append(float(match.group()))
+    return values
+
+class StationTable:
+    """
+    ตารางระดับน้ำของทุกสถานีจากหน้าเดียว เก็บแบบคอลัมน์ (array) พร้อมดัชนีชื่อสถานี
+    ค่าที่ไม่มีข้อมูลเก็บเป็น NaN
+    """
+    __slots__ = ("names", "levels", "banks", "statuses", "_index")
+
+    def __init__(self):
+        self.names: list[str] = []
+        self.levels = array('d')
+        self.banks = array('d')
+        self.statuses: list[str | None] = []
+        self._index: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str, level: float | None, bank: float | None, status: str | None = None) -> None:
+        self._index.setdefault(station_key(name), len(self.names))
+        self.names.append(name)
+        self.levels.append(NAN if level is None else level)
+        self.banks.append(NAN if bank is None else bank)
+        self.statuses.append(status)
+
+    def find(self, name: str) -> int | None:
+        """
+        คืนตำแหน่งของสถานี (เทียบชื่อย่อก่อน แล้วจึงค้นแบบบางส่วนของชื่อเต็ม)
+        ชื่อที่ระบุยาวกว่าชื่อย่อ (เช่น มีอำเภอ/จังหวัด) ค้นในชื่อเต็มก่อน เพราะชื่อย่อซ้ำกันได้
+        """
+        name = " ".join(name.split())
+        i = None if name != station_key(name) else self._index.get(name)
+        if i is not None:
+            return i
+        for i, full_name in enumerate(self.names):
+            if name in " ".join(full_name.split()):
+                return i
+        return self._index.get(station_key(name))
+
+    def get(self, name: str) -> dict | None:
+        i = self.find(name)
+        if i is None:
+            return None
+        level, bank = self.levels[i], self.banks[i]
+        return {
+            "name": self.names[i],
+            "level": None if isnan(level) else level,
+            "bank": None if isnan(bank) else bank,
+            "status": self.statuses[i],
+        }
+
+def station_key(name: str) -> str:
+    """ชื่อย่อของสถานี เช่น 'สถานีอินทร์บุรี ต.อินทร์บุรี ...' -> 'อินทร์บุรี'"""
+    name = name.strip()
+    if name.startswith("สถานี"):
+        name = name[len("สถานี"):]
+    return name.split(" ", 1)[0]
+
+def observation_key(name: str) -> str:
+    """
+    คีย์สถานีในคลังข้อมูล: ชื่อเต็มตามตาราง เพราะชื่อย่อซ้ำกันได้ระหว่างจังหวัด
+    ยกเว้นอินทร์บุรีที่คงชื่อเดิมไว้ให้ต่อกับข้อมูลที่บันทึกไปแล้ว
+    """
+    if station_key(name) == INBURI_STATION_NAME:
+        return INBURI_STATION_NAME
+    return " ".join(name.split())
+
+def _header_columns(headers: list[str]) -> dict[str, int]:
+    # จับคู่หัวตาราง (ไม่นับคอลัมน์ชื่อสถานี) กับตำแหน่งของ td ในแต่ละแถว
+    columns = {}
+    for i, text in enumerate(headers[1:]):
+        if "ตลิ่ง" in text:
+            columns.setdefault("bank", i)
+        elif "ระดับน้ำ" in text:
+            columns.setdefault("level", i)
+        elif "สถานการณ์" in text or "สถานะ" in text:
+            columns.setdefault("status", i)
+    return columns
+
+def _cell_number(text: str) -> float | None:
+    values = _numeric_cells([text])
+    return values[0] if values else None
+
+def parse_station_table(html: str, parser: str = HTML_PARSER) -> StationTable:
+    """
+    อ่านทุกแถวสถานี (th[scope='row']) ของตาราง singburi.thaiwater.net/wl ในการวนรอบเดียว
+    ใช้หัวตารางเพื่อหาคอลัมน์ระดับน้ำ/ตลิ่ง/สถานการณ์ หากไม่มีหัวตารางจะใช้ตัวเลขตัวแรกและตัวที่สองของแถว
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    soup = BeautifulSoup(html, parser, parse_only=SoupStrainer("tr"))
+    rows = []
+    for tr in soup.find_all("tr"):
+        th = tr.find("th", scope="row")
+        if th is None:
+            rows.append((None, [cell.get_text(strip=True) for cell in tr.find_all("th")]))
+        else:
+            rows.append((th.get_text(" ", strip=True), [td.get_text(strip=True) for td in tr.find_all("td")]))
+    return station_table_from_rows(rows)
+
+def station_table_from_rows(rows) -> StationTable:
+    """
+    สร้าง StationTable จากข้อความของแต่ละแถว: (ชื่อสถานี, ข้อความใน td) หรือ (None, ข้อความใน th) สำหรับหัวตาราง
+    ใช้ร่วมกันระหว่างการอ่าน HTML และการอ่าน DOM ผ่านเบราว์เซอร์
+    """
+    table = StationTable()
+    columns = None
+    for name, cells in rows:
+        if name is None:
+            if columns is None and cells:
+                columns = _header_columns(cells)
+            continue
+        if columns and "level" in columns:
+            level = _cell_number(cells[columns["level"]]) if columns["level"] < len(cells) else None
+            bank = _cell_number(cells[columns["bank"]]) if columns.get("bank", len(cells)) < len(cells) else None
+            status = cells[columns["status"]] if columns.get("status", len(cells)) < len(cells) else None
+        else:
+            numeric_values = _numeric_cells(cells)
+            level = numeric_values[0] if numeric_values else None
+            bank = numeric_values[1] if len(numeric_values) > 1 else None
+            status = None
+        table.add(name, level, bank, status or None)
+    return table
+
+def parse_station_json(payload) -> StationTable:
+    """
+    อ่านทุกสถานีจาก JSON ของ API thaiwater
+    รองรับ {"waterlevel_data": {"data": [...]}} (waterlevel_load), {"data": [...]} และลิสต์ของสถานีโดยตรง
+    โดยแต่ละรายการมี 'waterlevel_msl' และ 'station' -> 'tele_station_name' -> 'th' (และ 'min_bank' ถ้ามี)
+    """
+    if isinstance(payload, dict):
+        payload = payload.get("waterlevel_data", payload)
+    if isinstance(payload, dict):
+        payload = payload.get("data", [])
+    table = StationTable()
+    for item in payload or []:
+        station = item.get("station") or {}
+        name = station.get("tele_station_name") or {}
+        if isinstance(name, dict):
+            name = name.get("th", "")
+        level = _cell_number(str(item.get("waterlevel_msl", "")))
+        bank = _cell_number(str(station.get("min_bank", "")))
+        table.add(str(name), level, bank, item.get("situation_level"))
+    return table
+
+# ตารางสถานีล่าสุดที่อ่านได้ (ใช้ซ้ำได้โดยไม่ต้องดึงหน้าใหม่)
+last_station_table: StationTable | None = None
+
+def _inburi_from_table(table: StationTable):
+    global last_station_table
+    last_station_table = table
+    row = table.get(INBURI_STATION_NAME)
+    if row is None:
+        return None, None
+    if row["level"] is None:
+        print("⚠️ ไม่สามารถแปลงค่าระดับน้ำจากแถวอินทร์บุรีได้ — ไม่พบตัวเลขที่ถูกต้อง")
+        return None, None
+    # ใช้ระดับตลิ่งจากตาราง หากไม่มีจึงใช้ค่าคงที่ INBURI_BANK_LEVEL
+    bank = row["bank"] if row["bank"] is not None else INBURI_BANK_LEVEL
+    return row["level"], bank
+
+def parse_inburi_html(html: str, parser: str = HTML_PARSER):
+    """
+    อ่านแถวสถานีอินทร์บุรีจาก HTML ของตาราง singburi.thaiwater.net/wl
+    คืนค่า (ระดับน้ำ, ระดับตลิ่ง) หรือ (None, None) หากไม่พบ
+    """
+    return _inburi_from_table(parse_station_table(html, parser))
+
+def parse_inburi_json(payload):
+    """อ่านระดับน้ำอินทร์บุรีจาก JSON ของ API thaiwater (ดู parse_station_json)"""
+    return _inburi_from_table(parse_station_json(payload))
+
+def fetch_inburi_http(url: str, timeout: int = 15):
+    """
+    เส้นทางเร็ว: ดึงข้อมูลอินทร์บุรีด้วย requests โดยไม่เปิดเบราว์เซอร์
+    ใช้ SINGBURI_JSON_URL ก่อนหากกำหนดไว้ แล้วจึงลองอ่านตารางจาก HTML ของหน้า
+    คืนค่า (ระดับน้ำ, ระดับตลิ่ง, เส้นทางที่ใช้)
+    """
+    if SINGBURI_JSON_URL:
+        try:
+            with span("inburi.http_json"):
+                res = http_session.get(SINGBURI_JSON_URL, headers=HTTP_HEADERS, timeout=timeout)
+                count("bytes_downloaded", len(res.content), source="inburi")
+                res.raise_for_status()
+                level, bank = parse_inburi_json(res.json())
+            if level is not None:
+                return level, bank, "http-json"
+            print("⚠️ ไม่พบสถานีอินทร์บุรีใน JSON ของ SINGBURI_JSON_URL")
+        except Exception as e:
+            print(f"⚠️ ดึง JSON อินทร์บุรีไม่สำเร็จ: {e}")
+    with span("inburi.http_html"):
+        res = http_session.get(url, headers=HTTP_HEADERS, timeout=timeout)
+        count("bytes_downloaded", len(res.content), source="inburi")
+        res.raise_for_status()
+        res.encoding = 'utf-8'
+        level, bank = parse_inburi_html(res.text)
+    return level, bank, "http-html"
+
+# ตำแหน่ง chromedriver ที่ resolve แล้ว (ปักหมุดไว้ในไฟล์เพื่อให้รอบถัดไปใช้ได้โดยไม่ต้องออกเน็ต)
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH')
+CHROMEDRIVER_PIN_PATH = os.environ.get(
+    'CHROMEDRIVER_PIN_PATH', os.path.join(os.path.expanduser("~"), ".cache", "thai-water-alert", "chromedriver.json")
+)
+_chromedriver_resolved = False
+
+def resolve_chromedriver() -> str | None:
+    """
+    หา chromedriver เพียงครั้งเดียวต่อโปรเซส: ใช้ CHROMEDRIVER_PATH หรือไฟล์ที่ปักหมุดไว้ก่อน
+    หากไม่มีจึงเรียก ChromeDriverManager().install() แล้วปักหมุดผลลัพธ์
+    คืนค่า None เมื่อหาไม่ได้ (ให้ Selenium Manager ของ selenium จัดการเอง)
+    """
+    global CHROMEDRIVER_PATH, _chromedriver_resolved
+    if _chromedriver_resolved:
+        return CHROMEDRIVER_PATH
+    _chromedriver_resolved = True
+    if CHROMEDRIVER_PATH and os.path.exists(CHROMEDRIVER_PATH):
+        return CHROMEDRIVER_PATH
+    try:
+        with open(CHROMEDRIVER_PIN_PATH, encoding="utf-8") as f:
+            pinned = json.load(f).get("path")
+        if pinned and os.path.exists(pinned):
+            CHROMEDRIVER_PATH = pinned
+            return pinned
+    except (OSError, ValueError):
+        pass
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        with span("inburi.driver_resolve"):
+            CHROMEDRIVER_PATH = ChromeDriverManager().install()
+        os.makedirs(os.path.dirname(CHROMEDRIVER_PIN_PATH), exist_ok=True)
+        with open(CHROMEDRIVER_PIN_PATH, "w", encoding="utf-8") as f:
+            json.dump({"path": CHROMEDRIVER_PATH, "resolved_at": time.time()}, f)
+        print(f"📌 ปักหมุด chromedriver: {CHROMEDRIVER_PATH}")
+    except Exception as e:
+        print(f"⚠️ resolve chromedriver ไม่สำเร็จ ({e}) จะให้ Selenium Manager จัดการแทน")
+        CHROMEDRIVER_PATH = None
+    return CHROMEDRIVER_PATH
+
+def invalidate_chromedriver_pin() -> None:
+    """ลืม chromedriver ที่ปักหมุดไว้ (เช่น Chrome อัปเดตจนเวอร์ชันไม่ตรงกัน) ให้ resolve_chromedriver หาใหม่"""
+    global CHROMEDRIVER_PATH, _chromedriver_resolved
+    print(f"🧹 ยกเลิกการปักหมุด chromedriver: {CHROMEDRIVER_PATH}")
+    CHROMEDRIVER_PATH = None
+    _chromedriver_resolved = False
+    try:
+        os.remove(CHROMEDRIVER_PIN_PATH)
+    except OSError:
+        pass
+
+def _chrome_options():
+    from selenium.webdriver.chrome.options import Options
+
     opts = Options()
+    # eager: คืนค่าเมื่อ DOM พร้อม ไม่ต้องรอรูป/ฟอนต์/stylesheet โหลดครบ
+    opts.page_load_strategy = "eager"
     opts.add_argument("--headless")
     opts.add_argument("--no-sandbox")
     opts.add_argument("--disable-dev-shm-usage")
-    
-    driver = None
-    for attempt in range(retries):
+    opts.add_argument("--disable-gpu")
+    opts.add_argument("--disable-extensions")
+    opts.add_argument("--blink-settings=imagesEnabled=false")
+    opts.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    return opts
+
+def _open_driver(opts, shared: bool | None = None):
+    """shared=True ใช้/เก็บ _shared_driver (ค่าเริ่มต้นตาม KEEP_DRIVER) ผู้เรียกต้องถือ _shared_driver_lock"""
+    global _shared_driver
+    shared = KEEP_DRIVER if shared is None else shared
+    if shared and _shared_driver is not None:
+        return _shared_driver
+    from selenium import webdriver
+    from selenium.common.exceptions import SessionNotCreatedException
+    from selenium.webdriver.chrome.service import Service
+
+    driver_path = resolve_chromedriver()
+    try:
+        with span("inburi.chrome_start"):
+            driver = webdriver.Chrome(service=Service(driver_path) if driver_path else Service(), options=opts)
+    except SessionNotCreatedException as e:
+        if driver_path is None:
+            raise
+        # chromedriver ที่ปักหมุดไว้ไม่ตรงกับ Chrome ที่ติดตั้งอยู่: หาใหม่แล้วลองอีกครั้งเดียว
+        print(f"⚠️ เปิด Chrome ด้วย {driver_path} ไม่ได้: {e.msg}")
+        invalidate_chromedriver_pin()
+        driver_path = resolve_chromedriver()
+        with span("inburi.chrome_start"):
+            driver = webdriver.Chrome(service=Service(driver_path) if driver_path else Service(), options=opts)
+    if SELENIUM_BLOCKED_URLS:
         try:
-            driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=opts)
-            driver.get(url)
-            WebDriverWait(driver, timeout).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "th[scope='row']"))
-            )
-            html = driver.page_source
-            
-            soup = BeautifulSoup(html, "html.parser")
-            for th in soup.select("th[scope='row']"):
-                # ตรวจสอบว่าเป็นแถวข้อมูลของสถานีอินทร์บุรี
-                if "อินทร์บุรี" in th.get_text(strip=True):
-                    tr = th.find_parent("tr")
-                    cols = tr.find_all("td")
-                    water_level = None
-                    bank_level = None
-                    numeric_values: list[float] = []
-                    # วนลูปตรวจหาเซลล์ที่เป็นตัวเลข (เช่น ระดับน้ำและตลิ่ง)
-                    for td in cols:
-                        text = td.get_text(strip=True)
-                        # แปลงข้อความตัวเลขที่มี comma หรือตัวอักษรอื่น ๆ ออก
-                        # หากไม่สามารถแปลงเป็นตัวเลข ให้ข้าม
-                        try:
-                            # ลบ comma และช่องว่าง
-                            cleaned = re.sub(r"[ ,]", "", text)
-                            # แปลงตัวอักษรไทยบางตัวที่อาจเป็นตัวคั่น (เช่น “ม.”) ออกก่อนแปลง
-                            cleaned = re.sub(r"[^0-9\.\-]", "", cleaned)
-                            if cleaned == "" or cleaned == "-":
-                                continue
-                            num = float(cleaned)
-                            numeric_values.append(num)
-                        except Exception:
-                            # ไม่ใช่ค่าตัวเลข
-                            continue
-                    # กำหนด water level และ bank level จากลิสต์ค่าเลข หากพบ
-                    if numeric_values:
-                        water_level = numeric_values[0]
-                        # --- แก้ไขตรงนี้ ---
-                        # กำหนดค่าระดับตลิ่งเป็น 13.0 เมตรเสมอ
-                        bank_level = 13.0
-                        
-                        print(f"✅ พบข้อมูลอินทร์บุรี: ระดับน้ำ={water_level}, ระดับตลิ่ง={bank_level}")
-                        if driver:
-                            driver.quit()
-                        return water_level, bank_level
-                    # หากไม่พบตัวเลขในแถวนี้ ให้พิมพ์เตือนและไปเช็คแถวถัดไป
-                    print("⚠️ ไม่สามารถแปลงค่าระดับน้ำจากแถวอินทร์บุรีได้ — ไม่พบตัวเลขที่ถูกต้อง")
-                    continue
-            
-            print("⚠️ ไม่พบข้อมูลสถานี 'อินทร์บุรี' ในตาราง")
-            if driver: driver.quit()
-            return None, None
-        except StaleElementReferenceException:
-            print(f"⚠️ เจอ Stale Element Reference (ครั้งที่ {attempt + 1}/{retries}), กำลังลองใหม่...")
-            if driver: driver.quit()
-            time.sleep(3)
-            continue
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": SELENIUM_BLOCKED_URLS})
         except Exception as e:
-            print(f"❌ ERROR: get_inburi_data: {e}")
-            if driver: driver.quit()
-            return None, None
-    return None, None
+            print(f"⚠️ ตั้งค่าบล็อกทรัพยากรของ Chrome ไม่ได้: {e}")
+    if shared:
+        _shared_driver = driver
+    return driver
+
+def _close_driver(driver, broken: bool = False) -> None:
+    """ปิด driver เว้นแต่เป็น driver ที่ใช้ร่วมกันและยังใช้งานได้"""
+    global _shared_driver
+    if driver is None:
+        return
+    if driver is _shared_driver:
+        if not broken:
+            return
+        _shared_driver = None
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+# คืนข้อความของทุกแถวในตาราง (เหมือนที่ parse_station_table อ่านจาก HTML) เมื่อแถวของสถานี arguments[0] มีค่าแล้ว
+# มิฉะนั้นคืน null เพื่อให้ WebDriverWait รอต่อ: อ่านทั้งตารางใน round trip เดียว ไม่ต้องดึง page_source มา parse ใหม่
+_STATION_ROWS_JS = """
+const text = (el, sep) => el.textContent.replace(/\\s+/g, sep).trim();
+const target = Array.from(document.querySelectorAll("th[scope='row']")).find(th => th.textContent.includes(arguments[0]));
+if (!target || !target.parentElement.querySelector("td")) return null;
+const rows = [];
+for (const tr of document.querySelectorAll("tr")) {
+  const th = tr.querySelector("th[scope='row']");
+  if (th) rows.push([text(th, " "), Array.from(tr.querySelectorAll("td"), td => text(td, ""))]);
+  else rows.push([null, Array.from(tr.querySelectorAll("th"), h => text(h, ""))]);
+}
+return rows;
+"""
+
+def fetch_inburi_selenium(url: str, timeout: int = 45, retries: int = 3, cancel: threading.Event | None = None):
+    """
+    เส้นทางสำรอง: เปิด headless Chrome (eager, บล็อกทรัพยากรที่ไม่จำเป็น) แล้วรอเฉพาะแถวอินทร์บุรี
+    อ่านข้อความของตารางด้วย DOM query ครั้งเดียว ใช้ driver ตัวเดียวตลอดทุกครั้งที่ลองใหม่
+    หากกำหนด cancel และถูก set ระหว่างทาง จะหยุดก่อนเริ่มรอบถัดไป
+    """
+    from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    shared = KEEP_DRIVER and _shared_driver_lock.acquire(blocking=False)
+    if KEEP_DRIVER and not shared:
+        print("⚠️ Chrome ที่ใช้ร่วมกันยังถูกใช้โดยการดึงของรอบก่อนที่เกินเวลา จะเปิด Chrome ชั่วคราวแทน")
+    driver = None
+    try:
+        for attempt in range(retries):
+            if cancel is not None and cancel.is_set():
+                print("⏹️ ยกเลิกการดึงข้อมูลอินทร์บุรีด้วย Selenium (เกินกำหนดเวลา)")
+                return None, None
+            try:
+                if driver is None:
+                    driver = _open_driver(_chrome_options(), shared=shared)
+                # ไม่ให้ driver.get ค้างเกิน timeout (ค่าเริ่มต้นของ Chrome คือ 300 วินาที)
+                driver.set_page_load_timeout(timeout)
+                started = time.perf_counter()
+                try:
+                    with span("inburi.page_load"):
+                        driver.get(url)
+                except TimeoutException:
+                    # การโหลดที่ถูกตัดกลางทางอาจทิ้งหน้าไว้ในสภาพไม่แน่นอน: ไม่ใช้ driver นี้ต่อ
+                    print(f"❌ ERROR: get_inburi_data: โหลดหน้าไม่เสร็จภายใน {timeout} วินาที")
+                    _close_driver(driver, broken=True)
+                    driver = None
+                    return None, None
+                loaded = time.perf_counter()
+                with span("inburi.row_wait"):
+                    rows = WebDriverWait(driver, timeout).until(
+                        lambda d: d.execute_script(_STATION_ROWS_JS, INBURI_STATION_NAME)
+                    )
+                found = time.perf_counter()
+                with span("inburi.extract", rows=len(rows)):
+                    result = _inburi_from_table(station_table_from_rows(rows))
+                print(f"🌐 Selenium: โหลดหน้า {loaded - started:.2f} วินาที, รอแถว {found - loaded:.2f} วินาที, "
+                      f"อ่านค่า {(time.perf_counter() - found) * 1000:.1f} ms")
+                return result
+            except StaleElementReferenceException:
+                # หน้าถูก render ใหม่ระหว่างอ่าน: โหลดใหม่ด้วย driver ตัวเดิม
+                print(f"⚠️ เจอ Stale Element Reference (ครั้งที่ {attempt + 1}/{retries}), กำลังลองใหม่...")
+                count("retries", stage="inburi.selenium")
+                time.sleep(3)
+            except TimeoutException:
+                print(f"❌ ERROR: get_inburi_data: ไม่พบแถว{INBURI_STATION_NAME}ภายใน {timeout} วินาที")
+                return None, None
+            except WebDriverException as e:
+                # Chrome ล่มหรือหลุดการเชื่อมต่อ: เปิดตัวใหม่ในรอบถัดไป
+                print(f"⚠️ Chrome ผิดพลาด (ครั้งที่ {attempt + 1}/{retries}): {e.msg or e}")
+                count("retries", stage="inburi.selenium")
+                _close_driver(driver, broken=True)
+                driver = None
+            except Exception as e:
+                print(f"❌ ERROR: get_inburi_data: {e}")
+                _close_driver(driver, broken=True)
+                driver = None
+                return None, None
+        return None, None
+    finally:
+        if cancel is not None and cancel.is_set():
+            # รอบนี้เกินกำหนดเวลาไปแล้ว: ไม่คืน driver ที่อาจค้างอยู่กลางหน้าให้รอบถัดไป
+            _close_driver(driver, broken=True)
+        else:
+            _close_driver(driver)
+        if shared:
+            _shared_driver_lock.release()
+
+def get_inburi_data(url: str, timeout: int = 45, retries: int = 3, cancel: threading.Event | None = None):
+    """
+    ดึงระดับน้ำอินทร์บุรี: ลองเส้นทาง HTTP (ไม่ใช้เบราว์เซอร์) ก่อน
+    หากไม่สำเร็จจึงใช้ Selenium เป็นทางสำรอง และบันทึกเส้นทาง/เวลาที่ใช้ใน last_inburi_fetch
+    """
+    started = time.perf_counter()
+    try:
+        water_level, bank_level, path = fetch_inburi_http(url, timeout=min(timeout, 15))
+    except Exception as e:
+        print(f"⚠️ เส้นทาง HTTP ล้มเหลว: {e}")
+        water_level, bank_level, path = None, None, "http"
+    if water_level is None:
+        print(f"↪️ เส้นทาง {path} ไม่พบข้อมูลอินทร์บุรี กำลังใช้ Selenium แทน...")
+        water_level, bank_level = fetch_inburi_selenium(url, timeout=timeout, retries=retries, cancel=cancel)
+        path = "selenium"
+    elapsed = time.perf_counter() - started
+    last_inburi_fetch.update(path=path, elapsed=elapsed)
+    count("inburi_fetch", path=path, found=water_level is not None)
+    if water_level is None:
+        print(f"⚠️ ไม่พบข้อมูลสถานี 'อินทร์บุรี' ในตาราง (เส้นทาง: {path}, {elapsed:.2f} วินาที)")
+        return None, None
+    print(f"✅ พบข้อมูลอินทร์บุรี: ระดับน้ำ={water_level}, ระดับตลิ่ง={bank_level} (เส้นทาง: {path}, {elapsed:.2f} วินาที)")
+    return water_level, bank_level
+
+# --- ดึงข้อมูลเขื่อนเจ้าพระยา (conditional request + hash ของ json_data) ---
+HTTP_CACHE_PATH = os.environ.get('HTTP_CACHE_PATH', 'data/http_cache.json')
+
+# ตัวนับ: not_modified = server ตอบ 304, unchanged = json_data เหมือนเดิม, miss = ต้อง parse ใหม่
+fetch_cache_stats = {"not_modified": 0, "unchanged": 0, "miss": 0}
+_http_cache: dict | None = None
+
+def _http_cache_entry(url: str) -> dict:
+    global _http_cache
+    if _http_cache is None:
+        try:
+            with open(HTTP_CACHE_PATH, encoding="utf-8") as f:
+                _http_cache = json.load(f)
+        except (OSError, ValueError):
+            _http_cache = {}
+    return _http_cache.setdefault(url, {})
+
+def _save_http_cache() -> None:
+    try:
+        tmp_path = f"{HTTP_CACHE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_http_cache, f, ensure_ascii=False)
+        os.replace(tmp_path, HTTP_CACHE_PATH)
+    except OSError as e:
+        print(f"⚠️ บันทึก HTTP cache ไม่ได้ ({HTTP_CACHE_PATH}): {e}")
+
+JSON_DATA_MARKER = "var json_data ="
+
+def extract_json_data(text: str) -> str | None:
+    """
+    คืนข้อความ JSON ของ `var json_data = [...];` โดยค้นด้วย str.find/rfind แทน regex แบบ greedy
+    ได้ผลเหมือน regex เดิม: ตั้งแต่ '[' แรกจนถึง '];' ตัวสุดท้ายในบรรทัดเดียวกัน
+    """
+    start = text.find(JSON_DATA_MARKER)
+    if start < 0:
+        return None
+    start = text.find("[", start + len(JSON_DATA_MARKER))
+    if start < 0:
+        return None
+    line_end = text.find("\n", start)
+    end = text.rfind("];", start, line_end if line_end >= 0 else len(text))
+    if end < 0:
+        return None
+    return text[start:end + 1]
+
+class DischargeTable:
+    """
+    ตารางแบบคอลัมน์ของทุกสถานี/ทุกฟิลด์ใน itc_water (C2, C13, ...) จาก json_data
+    แต่ละแถวคือ (ลำดับชุดข้อมูล, รหัสสถานี) — ชุดที่ 0 คือข้อมูลล่าสุด
+    ค่าตัวเลขเก็บใน array('d') ต่อฟิลด์ (NaN = ไม่มีค่า) ค่าที่ไม่ใช่ตัวเลขเก็บแยกใน text
+    """
+    __slots__ = ("snapshots", "snapshot_ids", "stations", "columns", "text", "_rows")
+
+    def __init__(self):
+        self.snapshots: list[str] = []
+        self.snapshot_ids = array('i')
+        self.stations: list[str] = []
+        self.columns: dict[str, array] = {}
+        self.text: dict[tuple[int, str], str] = {}
+        self._rows: dict[tuple[int, str], int] = {}
+
+    @classmethod
+    def from_json(cls, data: list) -> "DischargeTable":
+        table = cls()
+        columns = table.columns
+        for snapshot, record in enumerate(data):
+            table.snapshots.append(f"{record.get('date', '')} {record.get('time', '')}".strip())
+            for code, fields in (record.get("itc_water") or {}).items():
+                row = len(table.stations)
+                table._rows[(snapshot, code)] = row
+                table.snapshot_ids.append(snapshot)
+                table.stations.append(code)
+                for name, raw in (fields or {}).items():
+                    column = columns.get(name)
+                    if column is None:
+                        column = columns[name] = array('d', [NAN]) * row
+                    column.append(_to_float(raw, table.text, (row, name)))
+                # ฟิลด์ที่สถานีนี้ไม่มี
+                for column in columns.values():
+                    if len(column) <= row:
+                        column.append(NAN)
+        return table
+
+    def get(self, station: str, field: str, snapshot: int = 0):
+        row = self._rows.get((snapshot, station))
+        column = self.columns.get(field)
+        if row is None or column is None:
+            return None
+        value = column[row]
+        if isnan(value):
+            return self.text.get((row, field))
+        return value
+
+    def station(self, station: str, snapshot: int = 0) -> dict | None:
+        if (snapshot, station) not in self._rows:
+            return None
+        return {field: self.get(station, field, snapshot) for field in self.columns}
+
+    def series(self, station: str, field: str) -> list:
+        """ค่าของสถานีตามลำดับชุดข้อมูล (ล่าสุดก่อน)"""
+        return [self.get(station, field, snapshot) for snapshot in range(len(self.snapshots))]
+
+    def station_codes(self, snapshot: int = 0) -> list[str]:
+        return [code for (snap, code) in self._rows if snap == snapshot]
+
+def _to_float(raw, text: dict, key) -> float:
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        return float(raw)
+    if raw is None:
+        return NAN
+    try:
+        return float(str(raw).replace(',', ''))
+    except ValueError:
+        text[key] = raw
+        return NAN
+
+def parse_discharge_table(text: str) -> DischargeTable | None:
+    """อ่าน json_data ทั้งก้อนจากหน้า chaopraya.php เป็น DischargeTable (None หากไม่พบ)"""
+    json_string = extract_json_data(text)
+    if json_string is None:
+        return None
+    return DischargeTable.from_json(json.loads(json_string))
+
+# ตารางล่าสุดที่อ่านได้ (ใช้สอบถามสถานีอื่นได้โดยไม่ต้อง parse ใหม่)
+last_discharge_table: DischargeTable | None = None
+# ปริมาณน้ำ (storage) ล่าสุดของทุกสถานี เก็บใน HTTP cache ด้วย จึงมีค่าแม้รอบที่ได้ 304
+last_dam_stations: dict[str, float] = {}
 
-# --- ดึงข้อมูลเขื่อนเจ้าพระยา (เพิ่ม Cache Busting) ---
 def fetch_chao_phraya_dam_discharge(url: str, timeout: int = 30):
+    """
+    ดึงปริมาณน้ำเขื่อนเจ้าพระยา (C13) โดยส่ง If-None-Match / If-Modified-Since ตามที่ server เคยให้มา
+    หากได้ 304 หรือ json_data มี hash เหมือนรอบก่อน จะคืนค่าเดิมโดยไม่ต้อง parse ใหม่
+    """
     try:
-        # เพิ่ม headers เพื่อพยายามไม่ให้ติด cache
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache'
-        }
-        # เพิ่มตัวเลขสุ่มต่อท้าย URL (Cache Busting)
-        cache_buster_url = f"{url}?cb={random.randint(10000, 99999)}"
-        
-        response = requests.get(cache_buster_url, headers=headers, timeout=10)
+        entry = _http_cache_entry(url)
+        # no-cache = ให้ cache ระหว่างทางตรวจกับต้นทางทุกครั้ง (แทนการสุ่ม ?cb= ซึ่งทำให้ใช้ conditional request ไม่ได้)
+        headers = dict(HTTP_HEADERS, **{'Cache-Control': 'no-cache'})
+        cached_value = entry.get("value")
+        if cached_value is not None:
+            if entry.get("etag"):
+                headers['If-None-Match'] = entry["etag"]
+            if entry.get("last_modified"):
+                headers['If-Modified-Since'] = entry["last_modified"]
+
+        with span("dam.http"):
+            response = http_session.get(url, headers=headers, timeout=10)
+        count("bytes_downloaded", len(response.content), source="dam")
+        global last_dam_stations
+        if response.status_code == 304 and cached_value is not None:
+            last_dam_stations = entry.get("stations") or {"C13": cached_value}
+            fetch_cache_stats["not_modified"] += 1
+            count("cache", source="dam", result="not_modified")
+            print(f"♻️ ข้อมูลเขื่อนเจ้าพระยาไม่เปลี่ยนแปลง (304): {cached_value}")
+            return cached_value
         response.raise_for_status()
         response.encoding = 'utf-8'
+        # validator ของหน้านี้จะถูกบันทึกเฉพาะเมื่ออ่าน json_data ได้สำเร็จ (ไม่ให้หน้าปิดปรับปรุงได้ 304 ในรอบถัดไป)
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
         
-        match = re.search(r'var json_data = (\[.*\]);', response.text)
-        if not match:
+        json_string = extract_json_data(response.text)
+        if json_string is None:
             print("❌ ERROR: ไม่พบข้อมูล JSON ในหน้าเว็บ")
             return None
             
-        json_string = match.group(1)
-        data = json.loads(json_string)
+        digest = hashlib.sha1(json_string.encode("utf-8")).hexdigest()
+        if digest == entry.get("hash") and cached_value is not None:
+            entry.update(validators)
+            last_dam_stations = entry.get("stations") or {"C13": cached_value}
+            fetch_cache_stats["unchanged"] += 1
+            count("cache", source="dam", result="unchanged")
+            _save_http_cache()
+            print(f"♻️ ข้อมูลเขื่อนเจ้าพระยาไม่เปลี่ยนแปลง (hash เดิม): {cached_value}")
+            return cached_value
+
+        fetch_cache_stats["miss"] += 1
+        count("cache", source="dam", result="miss")
+        global last_discharge_table
+        with span("dam.parse"):
+            last_discharge_table = DischargeTable.from_json(json.loads(json_string))
         
-        water_storage = data[0]['itc_water']['C13']['storage']
-        if water_storage is not None:
-            if isinstance(water_storage, (int, float)):
-                value = float(water_storage)
-            else:
-                value = float(str(water_storage).replace(',', ''))
-                
+        last_dam_stations = {}
+        for code in last_discharge_table.station_codes():
+            storage = last_discharge_table.get(code, 'storage')
+            if isinstance(storage, float):
+                last_dam_stations[code] = storage
+        water_storage = last_discharge_table.get('C13', 'storage')
+        if isinstance(water_storage, float):
+            value = water_storage
+            entry.update(validators, hash=digest, value=value, stations=last_dam_stations)
+            _save_http_cache()
             print(f"✅ พบข้อมูลเขื่อนเจ้าพระยา: {value}")
             return value
     except Exception as e:
         print(f"❌ ERROR: fetch_chao_phraya_dam_discharge: {e}")
     return None
 
+# --- แนวโน้มระดับน้ำ (NumPy) ---
+TREND_WINDOW_HOURS = float(os.environ.get('TREND_WINDOW_HOURS', '6'))
+TREND_MIN_POINTS = 3
+TREND_SMOOTHING = 0.5        # น้ำหนัก EWMA ของอัตราระหว่างจุดที่ติดกัน
+RISE_RATE_WATCH = 0.05       # ม./ชม. น้ำขึ้นเร็วกว่านี้อย่างน้อยเป็น 'เฝ้าระวัง'
+TREND_STEADY_RATE = 0.005    # ม./ชม. ขึ้น/ลงช้ากว่านี้แสดงเป็น 'ทรงตัว'
+HOURS_TO_BANK_RED = 12.0     # คาดว่าถึงตลิ่งภายในกี่ชั่วโมงจึงเป็น 'เตือนภัยสูงสุด'
+HOURS_TO_BANK_YELLOW = 48.0
+
+def robust_slopes(t: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    ความชัน Theil–Sen (median ของความชันทุกคู่จุด) ของหลายสถานีพร้อมกัน
+    t, y มีรูป (สถานี, จุด) หน่วยเวลาเป็นชั่วโมง ค่าที่ไม่มีให้เป็น NaN
+    """
+    i, j = np.triu_indices(t.shape[1], 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pair_slopes = (y[:, j] - y[:, i]) / (t[:, j] - t[:, i])
+    pair_slopes[~np.isfinite(pair_slopes)] = np.nan
+    out = np.full(t.shape[0], np.nan)
+    valid = ~np.isnan(pair_slopes).all(axis=1)
+    out[valid] = np.nanmedian(pair_slopes[valid], axis=1)
+    return out
+
+def smoothed_rates(t: np.ndarray, y: np.ndarray, alpha: float = TREND_SMOOTHING) -> np.ndarray:
+    """อัตราเปลี่ยนแปลงล่าสุดแบบ EWMA ของอัตราระหว่างจุดที่ติดกัน (รูปเดียวกับ robust_slopes)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.diff(y, axis=1) / np.diff(t, axis=1)
+    n = rates.shape[1]
+    weights = np.broadcast_to(alpha * (1 - alpha) ** np.arange(n - 1, -1, -1), rates.shape).copy()
+    mask = ~np.isfinite(rates)
+    weights[mask] = 0.0
+    rates = np.where(mask, 0.0, rates)
+    total = weights.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, (weights * rates).sum(axis=1) / total, np.nan)
+
+def hours_to_bank(levels: np.ndarray, banks: np.ndarray, rates: np.ndarray) -> np.ndarray:
+    """ชั่วโมงที่คาดว่าน้ำจะถึงตลิ่ง (inf หากน้ำไม่ได้ขึ้น, 0 หากถึงตลิ่งแล้ว)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hours = np.where(rates > 0, (banks - levels) / rates, np.inf)
+    return np.where(levels >= banks, 0.0, hours)
+
+def analyze_trends(t: np.ndarray, y: np.ndarray, banks: np.ndarray | None = None) -> dict[str, np.ndarray]:
+    """
+    คำนวณแนวโน้มของหลายสถานีในครั้งเดียว คืนค่า dict ของ array:
+    'slope' (Theil–Sen), 'rate' (EWMA), 'level' (ค่าล่าสุด) และ 'hours_to_bank' หากระบุ banks
+    อัตราที่ใช้คาดการณ์คือค่าที่มากกว่าระหว่าง slope และ rate เพื่อไม่ให้มองข้ามการขึ้นเร็วช่วงท้าย
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    slope = robust_slopes(t, y)
+    rate = smoothed_rates(t, y)
+    # ค่าล่าสุดที่ไม่ใช่ NaN ของแต่ละสถานี
+    last = np.where(~np.isnan(y), np.arange(y.shape[1]), -1).max(axis=1)
+    level = np.where(last >= 0, y[np.arange(y.shape[0]), np.maximum(last, 0)], np.nan)
+    result = {"slope": slope, "rate": rate, "level": level}
+    if banks is not None:
+        result["hours_to_bank"] = hours_to_bank(level, np.asarray(banks, dtype=float), np.fmax(slope, rate))
+    return result
+
+def station_trend(store: "ObservationStore", station: str, metric: str = "level",
+                  bank: float | None = None, window_hours: float = TREND_WINDOW_HOURS) -> dict | None:
+    """แนวโน้มของสถานีเดียวจากคลังข้อมูล คืนค่า None หากมีจุดข้อมูลไม่พอ"""
+    rows = store.range(station, metric, time.time() - window_hours * 3600)
+    if len(rows) < TREND_MIN_POINTS:
+        return None
+    data = np.asarray(rows, dtype=float)
+    t = (data[:, 0] - data[-1, 0])[None, :] / 3600.0
+    result = analyze_trends(t, data[:, 1][None, :], None if bank is None else [bank])
+    return {key: float(values[0]) for key, values in result.items()}
+
+# --- ค้นหาช่วงเวลาในอดีตที่ปริมาณน้ำคล้ายปัจจุบัน (analogue) ---
+HISTORY_CSV_FILES = ["data/dam_discharge_history_complete.csv", "data/historical_comparison_2554_2565_2567.csv"]
+ANALOGUE_WINDOW_DAYS = int(os.environ.get('ANALOGUE_WINDOW_DAYS', '7'))    # ความยาวเส้นกราฟที่ใช้เทียบ
+ANALOGUE_HORIZON_DAYS = int(os.environ.get('ANALOGUE_HORIZON_DAYS', '7'))  # ดูว่าเกิดอะไรต่อในกี่วัน
+ANALOGUE_K = 3
+ANALOGUE_SEASON_DAYS = 45   # ค้นเฉพาะช่วง ±45 วันจากวันนี้ (None = ทั้งปี)
+ANALOGUE_MAX_GAP = 5        # เติมค่าที่ขาดด้วยการประมาณเชิงเส้นเฉพาะช่องว่างไม่เกินกี่วัน
+
+_discharge_history = None
+
+def load_discharge_history(csv_files: list[str] = HISTORY_CSV_FILES):
+    """
+    รวมข้อมูลย้อนหลังทุกปี (ดัชนีจาก Excel + CSV) เป็น matrix ขนาด (จำนวนปี x 366) หน่วย ลบ.ม./วินาที
+    ค่าจาก Excel มีสิทธิ์ก่อน CSV เติมเฉพาะวันที่ยังว่าง คืนค่า (รายการปี, matrix)
+    """
+    global _discharge_history
+    index = get_historical_index()
+    key = (id(index), tuple((p, os.path.getmtime(p)) for p in csv_files if os.path.exists(p)))
+    if _discharge_history is not None and _discharge_history[0] == key:
+        return _discharge_history[1]
+    by_year: dict[int, np.ndarray] = {}
+    for i, year in enumerate(index.years):
+        row = np.frombuffer(index.values, dtype=np.int32, count=366, offset=i * 366 * 4).astype(float)
+        row[row == HISTORICAL_MISSING] = np.nan
+        by_year[year] = row
+    for path in csv_files:
+        if not os.path.exists(path):
+            continue
+        for when, value in iter_discharge_records(path):
+            row = by_year.setdefault(when.year + 543, np.full(366, np.nan))
+            offset = day_of_year_index(when.month, when.day)
+            if np.isnan(row[offset]):
+                row[offset] = value
+    years = sorted(by_year)
+    matrix = np.vstack([by_year[year] for year in years]) if years else np.empty((0, 366))
+    _discharge_history = (key, (years, _fill_gaps(matrix, ANALOGUE_MAX_GAP)))
+    return _discharge_history[1]
+
+def _fill_gaps(matrix, max_gap: int):
+    """ประมาณค่าเชิงเส้นในช่องว่างที่ยาวไม่เกิน max_gap วัน (ช่องว่างที่ยาวกว่านั้นคงเป็น NaN)"""
+    filled = matrix.copy()
+    positions = np.arange(matrix.shape[1])
+    for row in filled:
+        valid = ~np.isnan(row)
+        if valid.sum() < 2:
+            continue
+        idx = positions[valid]
+        # ความยาวช่องว่างที่แต่ละตำแหน่งอยู่ = ระยะระหว่างจุดที่มีค่าก่อนหน้าและถัดไป
+        right = np.searchsorted(idx, positions)
+        inside = (right > 0) & (right < len(idx))
+        gap = np.full(len(row), np.inf)
+        gap[inside] = idx[right[inside]] - idx[right[inside] - 1] - 1
+        fill = ~valid & (gap <= max_gap)
+        row[fill] = np.interp(positions[fill], idx, row[valid])
+    return filled
+
+def find_analogues(current, years: list[int], history, end_offset: int,
+                   k: int = ANALOGUE_K, horizon: int = ANALOGUE_HORIZON_DAYS,
+                   season_days: int | None = ANALOGUE_SEASON_DAYS) -> list[dict]:
+    """
+    หา k ช่วงในอดีต (ปีละไม่เกินหนึ่งช่วง) ที่เส้นปริมาณน้ำ N วันล่าสุด (current, NaN ได้) ใกล้เคียงที่สุดด้วย RMSE
+    โดยเลื่อนหน้าต่างทุกตำแหน่งของทุกปีพร้อมกัน (sliding_window_view) แล้วรายงานสิ่งที่เกิดต่อใน horizon วัน
+    end_offset คือตำแหน่งวันของวันนี้ในปฏิทิน 366 วัน (ใช้จำกัดฤดูกาลเมื่อระบุ season_days)
+    """
+
+    current = np.asarray(current, dtype=float)
+    n = len(current)
+    mask = ~np.isnan(current)
+    if history.shape[0] == 0 or mask.sum() < 2 or history.shape[1] < n + horizon:
+        return []
+    # windows[y, s] = history[y, s:s+n] — ไม่ต้องคัดลอกข้อมูล
+    windows = np.lib.stride_tricks.sliding_window_view(history[:, : history.shape[1] - horizon], n, axis=1)
+    diff = windows[..., mask] - current[mask]
+    distance = np.sqrt(np.mean(diff * diff, axis=-1))
+    distance[np.isnan(distance)] = np.inf
+    if season_days is not None:
+        ends = np.arange(windows.shape[1]) + n - 1
+        distance[:, np.abs(ends - end_offset) > season_days] = np.inf
+    # เลือกช่วงที่ดีที่สุดของแต่ละปี (ไม่ให้หน้าต่างที่ซ้อนกันในปีเดียวกันกินที่ทั้ง k อันดับ)
+    best_start = distance.argmin(axis=1)
+    best = distance[np.arange(len(years)), best_start]
+    results = []
+    for y in np.argsort(best)[:k]:
+        start = best_start[y]
+        if not np.isfinite(best[y]):
+            break
+        end = start + n - 1
+        ahead = history[y, end + 1 : end + 1 + horizon]
+        results.append({
+            "year": years[y],
+            "end_offset": int(end),
+            "distance": float(distance[y, start]),
+            "value": float(history[y, end]),
+            "next_max": float(np.nanmax(ahead)) if (~np.isnan(ahead)).any() else None,
+            "next_last": None if np.isnan(ahead[-1]) else float(ahead[-1]),
+        })
+    return results
+
+def offset_to_day_month(offset: int) -> tuple[int, int]:
+    """แปลงตำแหน่ง 0..365 กลับเป็น (วัน, เดือน)"""
+    month = max(m for m in range(1, 13) if _DAY_OFFSETS[m] <= offset)
+    return offset - _DAY_OFFSETS[month] + 1, month
+
+def current_discharge_window(store: "ObservationStore", days: int = ANALOGUE_WINDOW_DAYS,
+                             station: str = "C13", metric: str = "discharge"):
+    """ค่าเฉลี่ยรายวัน (เวลากรุงเทพ) ของ N วันล่าสุดจากคลังข้อมูล คืนค่า None หากมีข้อมูลไม่ถึงครึ่ง"""
+    tz = pytz.timezone('Asia/Bangkok')
+    today = datetime.now(tz).date()
+    rows = store.range(station, metric, time.time() - (days + 1) * 86400)
+    sums = np.zeros(days)
+    counts = np.zeros(days)
+    for ts, value in rows:
+        age = (today - datetime.fromtimestamp(ts, tz).date()).days
+        if 0 <= age < days:
+            sums[days - 1 - age] += value
+            counts[days - 1 - age] += 1
+    if (counts > 0).sum() < max(2, (days + 1) // 2):
+        return None
+    with np.errstate(invalid="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+def discharge_analogues(store: "ObservationStore") -> list[dict]:
+    """หาช่วงในอดีตที่คล้ายกับ ANALOGUE_WINDOW_DAYS วันล่าสุดของเขื่อนเจ้าพระยา"""
+    current = current_discharge_window(store)
+    if current is None:
+        return []
+    years, history = load_discharge_history()
+    now = datetime.now(pytz.timezone('Asia/Bangkok'))
+    return find_analogues(current, years, history, day_of_year_index(now.month, now.day))
+
 # --- วิเคราะห์และสร้างข้อความ ---
-def analyze_and_create_message(inburi_level, dam_discharge, bank_height, hist_2567=None, hist_2565=None, hist_2554=None):
+def _fmax(a: float, b: float) -> float:
+    # เหมือน numpy.fmax: ไม่สนค่า NaN หากอีกค่าหนึ่งมีค่า
+    if isnan(a):
+        return b
+    if isnan(b):
+        return a
+    return max(a, b)
+
+# เกณฑ์เตือนภัยเริ่มต้น (แต่ละกลุ่มใน subscriptions.json กำหนดทับบางค่าได้)
+ALERT_THRESHOLDS = {
+    "discharge_red": 2400.0,      # ลบ.ม./วินาที
+    "discharge_yellow": 1800.0,
+    "distance_red": 1.0,          # เมตรจากขอบตลิ่ง
+    "distance_yellow": 2.0,
+    "hours_to_bank_red": HOURS_TO_BANK_RED,
+    "hours_to_bank_yellow": HOURS_TO_BANK_YELLOW,
+    "rise_rate_watch": RISE_RATE_WATCH,
+}
+
+def classify_alert(inburi_level, dam_discharge, bank_height, trend: dict | None = None,
+                   thresholds: dict | None = None) -> str:
+    """
+    คืนค่าระดับการเตือน: 'red' (เตือนภัยสูงสุด), 'yellow' (เฝ้าระวัง) หรือ 'green' (ปกติ)
+    หากมี trend (ดู station_trend) จะพิจารณาอัตราน้ำขึ้นและเวลาที่คาดว่าจะถึงตลิ่งด้วย
+    thresholds ใช้แทนค่าบางตัวใน ALERT_THRESHOLDS ได้
+    """
+    t = ALERT_THRESHOLDS if not thresholds else {**ALERT_THRESHOLDS, **thresholds}
     distance_to_bank = bank_height - inburi_level
+    hours = trend.get("hours_to_bank", inf) if trend else inf
+    rising = _fmax(trend.get("slope", NAN), trend.get("rate", NAN)) if trend else NAN
+    if (dam_discharge > t["discharge_red"] or distance_to_bank < t["distance_red"]
+            or hours < t["hours_to_bank_red"]):
+        return "red"
+    if (dam_discharge > t["discharge_yellow"] or distance_to_bank < t["distance_yellow"]
+            or hours < t["hours_to_bank_yellow"] or rising >= t["rise_rate_watch"]):
+        return "yellow"
+    return "green"
+
+# ไอคอน หัวข้อ และคำแนะนำของแต่ละระดับการเตือน
+TIER_TEXT = {
+    "red": (
+        "🟥",
+        "‼️ ประกาศเตือนภัยระดับสูงสุด ‼️",
+        "คำแนะนำ:\n1. เตรียมพร้อมอพยพหากอยู่ในพื้นที่เสี่ยง\n2. ขนย้ายทรัพย์สินขึ้นที่สูงโดยด่วน\n3. งดใช้เส้นทางสัญจรริมแม่น้ำ",
+    ),
+    "yellow": (
+        "🟨",
+        "‼️ ประกาศเฝ้าระวัง ‼️",
+        "คำแนะนำ:\n1. บ้านเรือนริมตลิ่งนอกคันกั้นน้ำ ให้เริ่มขนของขึ้นที่สูง\n2. ติดตามสถานการณ์อย่างใกล้ชิด",
+    ),
+    "green": ("🟩", "สถานะปกติ", "สถานการณ์น้ำยังปกติ ใช้ชีวิตได้ตามปกติครับ"),
+}
+
+def analyze_and_create_message(inburi_level, dam_discharge, bank_height, hist_2567=None, hist_2565=None, hist_2554=None,
+                               trend: dict | None = None, analogues: list[dict] | None = None,
+                               station: str = INBURI_STATION_NAME, thresholds: dict | None = None,
+                               now: datetime | None = None):
+    # now: เวลาที่ลงในข้อความ (ค่าเริ่มต้นคือเวลาปัจจุบัน replay.py ใช้เวลาของ snapshot)
+    distance_to_bank = bank_height - inburi_level
+    tier = classify_alert(inburi_level, dam_discharge, bank_height, trend, thresholds)
     
-    ICON = ""
-    HEADER = ""
-    summary_text = ""
-
-    if dam_discharge > 2400 or distance_to_bank < 1.0:
-        ICON = "🟥"
-        HEADER = "‼️ ประกาศเตือนภัยระดับสูงสุด ‼️"
-        summary_text = "คำแนะนำ:\n1. เตรียมพร้อมอพยพหากอยู่ในพื้นที่เสี่ยง\n2. ขนย้ายทรัพย์สินขึ้นที่สูงโดยด่วน\n3. งดใช้เส้นทางสัญจรริมแม่น้ำ"
-    elif dam_discharge > 1800 or distance_to_bank < 2.0:
-        ICON = "🟨"
-        HEADER = "‼️ ประกาศเฝ้าระวัง ‼️"
-        summary_text = "คำแนะนำ:\n1. บ้านเรือนริมตลิ่งนอกคันกั้นน้ำ ให้เริ่มขนของขึ้นที่สูง\n2. ติดตามสถานการณ์อย่างใกล้ชิด"
-    else:
-        ICON = "🟩"
-        HEADER = "สถานะปกติ"
-        summary_text = "สถานการณ์น้ำยังปกติ ใช้ชีวิตได้ตามปกติครับ"
+    ICON, HEADER, summary_text = TIER_TEXT[tier]
 
-    now = datetime.now(pytz.timezone('Asia/Bangkok'))
+    now = now or datetime.now(pytz.timezone('Asia/Bangkok'))
     TIMESTAMP = now.strftime('%d/%m/%Y %H:%M')
 
     msg_lines = [
         f"{ICON} {HEADER}",
         "",
-        f"📍 รายงานสถานการณ์น้ำเจ้าพระยา จ.อ.อินทร์บุรี",
+        f"📍 รายงานสถานการณ์น้ำเจ้าพระยา จ.อ.{station}",
         f"🗓️ วันที่: {TIMESTAMP} น.",
         "",
         "🌊 ระดับน้ำ + ระดับตลิ่ง",
-        f"  • อินทร์บุรี: {inburi_level:.2f} ม.รทก.",
+        f"  • {station}: {inburi_level:.2f} ม.รทก.",
         f"  • ตลิ่ง: {bank_height:.2f} ม.รทก. (ต่ำกว่า {distance_to_bank:.2f} ม.)",
+    ]
+    if trend and isfinite(trend.get("rate", NAN)):
+        rate = _fmax(trend["slope"], trend["rate"])
+        if abs(rate) < TREND_STEADY_RATE:
+            msg_lines.append("  • แนวโน้ม: ทรงตัว")
+        else:
+            direction = "ขึ้น" if rate > 0 else "ลง"
+            msg_lines.append(f"  • แนวโน้ม: {direction} {abs(rate) * 100:.1f} ซม./ชม.")
+        hours = trend.get("hours_to_bank", inf)
+        if isfinite(hours):
+            msg_lines.append(f"  • คาดว่าจะถึงตลิ่งในอีกประมาณ {hours:.0f} ชม.")
+    msg_lines += [
         "",
         "💧 ปริมาณน้ำปล่อยเขื่อนเจ้าพระยา",
         f"  {dam_discharge:,} ลบ.ม./วินาที",
@@ -261,6 +1529,12 @@ def analyze_and_create_message(inburi_level, dam_discharge, bank_height, hist_25
         msg_lines.append(f"  • ปี 2565: {hist_2565:,} ลบ.ม./วินาที")
     if hist_2554 is not None:
         msg_lines.append(f"  • ปี 2554: {hist_2554:,} ลบ.ม./วินาที")
+    for analogue in analogues or []:
+        day, month = offset_to_day_month(analogue["end_offset"])
+        line = f"  • ใกล้เคียงปี {analogue['year']} ({day}/{month}: {analogue['value']:,.0f})"
+        if analogue["next_max"] is not None:
+            line += f" → {ANALOGUE_HORIZON_DAYS} วันถัดมาสูงสุด {analogue['next_max']:,.0f} ลบ.ม./วินาที"
+        msg_lines.append(line)
     msg_lines += [
         "",
         summary_text
@@ -268,80 +1542,233 @@ def analyze_and_create_message(inburi_level, dam_discharge, bank_height, hist_25
     return "\n".join(msg_lines)
 
 # --- สร้างข้อความ Error ---
-def create_error_message(inburi_status, discharge_status):
+def create_error_message(inburi_status, discharge_status, statuses: list[tuple[str, str]] | None = None):
+    """statuses=[(ข้อมูล, สถานะ), ...] ใช้แทนสองบรรทัดมาตรฐาน (เช่น ระบุสถานีที่ไม่มีข้อมูลของแต่ละกลุ่มผู้รับ)"""
     now = datetime.now(pytz.timezone('Asia/Bangkok'))
+    if statuses is None:
+        statuses = [("ระดับน้ำอินทร์บุรี", inburi_status), ("เขื่อนเจ้าพระยา", discharge_status)]
+    lines = "".join(f"• สถานะข้อมูล{label}: {status}\n" for label, status in statuses)
     return (
         f"⚙️❌ เกิดข้อผิดพลาดในการดึงข้อมูล ❌⚙️\n"
         f"เวลา: {now.strftime('%d/%m/%Y %H:%M')} น.\n\n"
-        f"• สถานะข้อมูลระดับน้ำอินทร์บุรี: {inburi_status}\n"
-        f"• สถานะข้อมูลเขื่อนเจ้าพระยา: {discharge_status}\n\n"
+        f"{lines}\n"
         f"กรุณาตรวจสอบ Log บน GitHub Actions เพื่อดูรายละเอียดข้อผิดพลาดครับ"
     )
 
-# --- ส่งข้อความ LINE (ฉบับปรับปรุง) ---
-def send_line_push(message):
-    if not LINE_TOKEN:
-        print("❌ ไม่พบ LINE_CHANNEL_ACCESS_TOKEN!")
-        return
-    if not LINE_GROUP_ID:
-        print("❌ ไม่พบ LINE_GROUP_ID! กรุณาตั้งค่าใน GitHub Secrets")
-        return
+# --- ส่งแจ้งเตือน (LINE หลายกลุ่ม + Webhook หลายปลายทาง พร้อมกัน) ---
+NOTIFY_QUEUE_PATH = os.environ.get('NOTIFY_QUEUE_PATH', 'data/notify_queue.jsonl')
+NOTIFY_DEADLINE = float(os.environ.get('NOTIFY_DEADLINE', '60'))              # วินาทีต่อรอบการส่ง
+NOTIFY_QUEUE_MAX_AGE = float(os.environ.get('NOTIFY_QUEUE_MAX_AGE', '21600'))  # ข้อความค้างเกิน 6 ชม. จะถูกทิ้ง
+NOTIFY_BACKOFF = float(os.environ.get('NOTIFY_BACKOFF', '1.0'))               # วินาที (เพิ่มเป็นเท่าตัวทุกครั้งที่ลองใหม่)
+NOTIFY_WORKERS = 16
+# อัตราส่ง (ครั้ง/วินาที, จำนวนที่ส่งติดกันได้) ต่อปลายทาง
+LINE_RATE_LIMIT = (10.0, 10)
+WEBHOOK_RATE_LIMIT = (5.0, 5)
 
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {LINE_TOKEN}"}
-    # Payload for Push Message
-    payload = {
-        "to": LINE_GROUP_ID,
-        "messages": [{"type": "text", "text": message}]
-    }
-    
-    retries = 3 # จำนวนครั้งที่จะลองใหม่
-    delay = 5   # เริ่มต้นรอ 5 วินาที
+class TokenBucket:
+    """ตัวจำกัดอัตราแบบ token bucket ที่หยุดชั่วคราวได้ตาม Retry-After ของคำตอบ 429"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def acquire(self, deadline: float) -> bool:
+        """รอจนได้ token หนึ่งตัว คืนค่า False หากต้องรอเกิน deadline (time.monotonic())"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
 
-    for i in range(retries):
+def _bucket_for(delivery: dict) -> TokenBucket:
+    # LINE ทุกกลุ่มใช้โควตาเดียวกัน (ผูกกับ channel token) ส่วน webhook แยกตาม URL
+    key = "line" if delivery["kind"] == "line" else delivery["target"]
+    with _buckets_lock:
+        if key not in _buckets:
+            rate, capacity = LINE_RATE_LIMIT if delivery["kind"] == "line" else WEBHOOK_RATE_LIMIT
+            _buckets[key] = TokenBucket(rate, capacity)
+        return _buckets[key]
+
+def _retry_after(response) -> float | None:
+    """อ่าน Retry-After (วินาที หรือวันที่แบบ HTTP) จากคำตอบ"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(pytz.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def _label(delivery: dict) -> str:
+    if delivery["kind"] == "line":
+        return f"LINE {delivery['target'][:8]}…"
+    return f"Webhook {urlparse(delivery['target']).netloc}"
+
+def _deliver(delivery: dict, deadline: float) -> str:
+    """
+    ส่งรายการเดียวจนสำเร็จหรือหมดเวลา คืนค่า 'sent', 'dropped' (ผิดพลาดถาวร เช่น 400)
+    หรือ 'failed' (ควรเก็บเข้าคิวไว้ส่งรอบหน้า)
+    """
+    bucket = _bucket_for(delivery)
+    label = _label(delivery)
+    delay = NOTIFY_BACKOFF
+    if delivery["kind"] == "line":
+        url = LINE_PUSH_API_URL
+        # คีย์เดิมทุกครั้งที่ลองใหม่ (รวมรอบถัดไปจากคิว) LINE จึงไม่ส่งซ้ำหากครั้งก่อนถึงแล้วแต่เราไม่ได้รับคำตอบ
+        retry_key = delivery.setdefault("retry_key", str(uuid.uuid4()))
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {LINE_TOKEN}",
+                   "X-Line-Retry-Key": retry_key}
+    else:
+        url = delivery["target"]
+        headers = {"Content-Type": "application/json"}
+    while True:
+        if not bucket.acquire(deadline):
+            print(f"⏳ {label}: หมดเวลารอโควตาการส่ง เก็บเข้าคิวไว้ส่งรอบหน้า")
+            return "failed"
+        delivery["attempts"] = delivery.get("attempts", 0) + 1
+        count("notify_attempts", kind=delivery["kind"])
         try:
-            # Use the PUSH API URL
-            res = requests.post(LINE_PUSH_API_URL, headers=headers, json=payload, timeout=15)
-            res.raise_for_status() 
-            
-            print("✅ ส่งข้อความ Push สำเร็จ!")
-            return
-            
-        except requests.exceptions.HTTPError as err:
-            if err.response.status_code == 429:
-                print(f"⚠️ API แจ้งว่าส่งถี่เกินไป (429), กำลังลองใหม่ในอีก {delay} วินาที... (ครั้งที่ {i + 1}/{retries})")
-                time.sleep(delay)
-                delay *= 2
+            res = http_session.post(url, headers=headers, json=delivery["body"],
+                                    timeout=max(1.0, min(15.0, deadline - time.monotonic())))
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ {label}: ส่งไม่สำเร็จ ({e})")
+            count("retries", stage=f"notify.{delivery['kind']}", reason="error")
+            wait = delay
+        else:
+            if res.ok:
+                print(f"✅ {label}: ส่งสำเร็จ!")
+                return "sent"
+            if res.status_code == 409 and delivery["kind"] == "line":
+                # 409 กับ X-Line-Retry-Key: คำขอนี้เคยถูกรับไปแล้ว ไม่ต้องส่งซ้ำ
+                print(f"✅ {label}: ส่งถึงแล้วตั้งแต่ครั้งก่อน (409)")
+                return "sent"
+            if res.status_code == 429:
+                wait = _retry_after(res) or delay
+                bucket.pause(wait)
+                count("retries", stage=f"notify.{delivery['kind']}", reason="429")
+                print(f"⚠️ {label}: API แจ้งว่าส่งถี่เกินไป (429), ลองใหม่ในอีก {wait:.1f} วินาที")
+            elif res.status_code >= 500:
+                wait = delay
+                count("retries", stage=f"notify.{delivery['kind']}", reason="5xx")
+                print(f"⚠️ {label}: เซิร์ฟเวอร์ผิดพลาด ({res.status_code}), ลองใหม่ในอีก {wait:.1f} วินาที")
             else:
-                print(f"❌ ERROR: LINE Push (HTTP Error): {err}")
-                print(f"    Response: {err.response.text}") # Print error response for more details
-                break
-        except Exception as e:
-            print(f"❌ ERROR: LINE Push (General Error): {e}")
-            break
+                print(f"❌ ERROR: {label} (HTTP {res.status_code}): {res.text[:200]}")
+                return "dropped"
+        if time.monotonic() + wait > deadline:
+            print(f"⏳ {label}: หมดเวลา เก็บเข้าคิวไว้ส่งรอบหน้า")
+            return "failed"
+        time.sleep(wait)
+        delay *= 2
 
-    print("❌ ไม่สามารถส่งข้อความได้หลังจากการพยายามหลายครั้ง")
+def _load_queue(path: str = NOTIFY_QUEUE_PATH) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    pending = []
+    now = time.time()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                delivery = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if now - delivery.get("created", now) > NOTIFY_QUEUE_MAX_AGE:
+                print(f"🗑️ ทิ้งข้อความค้างที่เก่าเกินไป ({_label(delivery)})")
+                continue
+            pending.append(delivery)
+    return pending
 
-# --- ส่งข้อมูลไปยัง Make Webhook ---
-def send_make_webhook(message: str, extra_data: dict | None = None) -> None:
+def _save_queue(deliveries: list[dict], path: str = NOTIFY_QUEUE_PATH) -> None:
+    if not deliveries:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for delivery in deliveries:
+            f.write(json.dumps(delivery, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+def dispatch(deliveries: list[dict], deadline: float = NOTIFY_DEADLINE, queue_path: str = NOTIFY_QUEUE_PATH) -> dict[str, int]:
+    """
+    ส่งทุกรายการ (รวมรายการค้างในคิวจากรอบก่อน) พร้อมกันบน thread pool ที่ใช้ http_session ร่วมกัน
+    ปลายทางที่ถูกจำกัดอัตราจะไม่หน่วงปลายทางอื่น รายการที่ส่งไม่ทันจะถูกบันทึกลงคิวบนดิสก์
+    คืนค่าจำนวน sent / dropped / failed
     """
-    ส่งข้อความและข้อมูลเพิ่มเติมไปยัง Make.com ผ่าน Webhook
+    pending = _load_queue(queue_path)
+    if pending:
+        print(f"📬 พบข้อความค้างส่ง {len(pending)} รายการจากรอบก่อน")
+    deliveries = pending + deliveries
+    counts = {"sent": 0, "dropped": 0, "failed": 0}
+    if not deliveries:
+        return counts
+    stop_at = time.monotonic() + deadline
+    failed = []
+    with span("notify.dispatch", deliveries=len(deliveries)), \
+            ThreadPoolExecutor(max_workers=min(NOTIFY_WORKERS, len(deliveries))) as pool:
+        for delivery, outcome in zip(deliveries, pool.map(lambda d: _deliver(d, stop_at), deliveries)):
+            counts[outcome] += 1
+            count("notify_outcome", kind=delivery["kind"], outcome=outcome)
+            if outcome == "failed":
+                failed.append(delivery)
+    _save_queue(failed, queue_path)
+    return counts
 
-    Parameters
-    ----------
-    message : str
-        ข้อความหลักที่จะส่ง (เช่น ข้อความสรุปสถานการณ์น้ำ)
-    extra_data : dict | None, optional
-        ข้อมูลเพิ่มเติม (เช่น ค่าตัวเลขต่าง ๆ) ที่จะรวมเข้ากับ Payload (ค่าเริ่มต้นคือ None)
+def _new_delivery(kind: str, target: str, body: dict) -> dict:
+    delivery = {"kind": kind, "target": target, "body": body, "created": time.time(), "attempts": 0}
+    if kind == "line":
+        # สร้างครั้งเดียวต่อรายการและเก็บไว้ในคิวด้วย (ดู _deliver)
+        delivery["retry_key"] = str(uuid.uuid4())
+    return delivery
 
-    รายละเอียด:
-        - หากไม่พบตัวแปรสภาพแวดล้อม MAKE_WEBHOOK_URL จะไม่ทำการส่งข้อมูลและแสดงข้อความแจ้งเตือน
-        - Payload จะประกอบด้วยคีย์ 'message' และรวมคีย์จาก extra_data ถ้ามี
-        - ใช้ไลบรารี requests ในการ POST ข้อมูลเป็น JSON
+def line_deliveries(message: str, group_ids: list[str] | None = None) -> list[dict]:
+    """สร้างรายการส่ง LINE ไปยัง group_ids (ค่าเริ่มต้น: LINE_GROUP_IDS)"""
+    group_ids = LINE_GROUP_IDS if group_ids is None else group_ids
+    if not LINE_TOKEN:
+        print("❌ ไม่พบ LINE_CHANNEL_ACCESS_TOKEN!")
+        return []
+    if not group_ids:
+        print("❌ ไม่พบ LINE_GROUP_ID! กรุณาตั้งค่าใน GitHub Secrets")
+        return []
+    return [
+        _new_delivery("line", group_id, {"to": group_id, "messages": [{"type": "text", "text": message}]})
+        for group_id in group_ids
+    ]
+
+def webhook_deliveries(message: str, extra_data: dict | None = None, urls: list[str] | None = None) -> list[dict]:
+    """
+    สร้างรายการส่งไปยัง Make.com ทุก URL ใน urls (ค่าเริ่มต้น: MAKE_WEBHOOK_URLS)
+    Payload ประกอบด้วยคีย์ 'message' และรวมคีย์จาก extra_data ถ้ามี
     """
-    url = MAKE_WEBHOOK_URL
-    if not url:
+    urls = MAKE_WEBHOOK_URLS if urls is None else urls
+    if not urls:
         print("⚠️ ไม่พบ MAKE_WEBHOOK_URL ในสภาพแวดล้อม จึงไม่ส่งข้อมูลไปยัง Make Webhook")
-        return
+        return []
 
     # สร้างข้อมูลส่งออกเป็น JSON
     payload = {"message": message}
@@ -354,55 +1781,334 @@ def send_make_webhook(message: str, extra_data: dict | None = None) -> None:
         except Exception:
             # หากเกิดข้อผิดพลาดในการรวมข้อมูล ไม่ให้กระทบข้อมูลหลัก
             pass
+    return [_new_delivery("webhook", url, payload) for url in urls]
 
-    headers = {"Content-Type": "application/json"}
+def send_line_push(message):
+    """ส่งข้อความ Push ไปยังทุกกลุ่มใน LINE_GROUP_IDS"""
+    return dispatch(line_deliveries(message))
+
+def send_make_webhook(message: str, extra_data: dict | None = None) -> None:
+    """ส่งข้อความและข้อมูลเพิ่มเติมไปยัง Make.com ทุก URL ใน MAKE_WEBHOOK_URLS"""
+    return dispatch(webhook_deliveries(message, extra_data))
+
+# --- ขั้นตอนดึงข้อมูลพร้อมกัน (มีกำหนดเวลา) ---
+@dataclass
+class SourceResult:
+    """ผลการดึงข้อมูลจากแหล่งหนึ่ง: status เป็น 'ok', 'empty', 'error' หรือ 'timeout'"""
+    name: str
+    status: str = "pending"
+    value: object = None
+    elapsed: float | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+@dataclass
+class AcquisitionResult:
+    sources: dict[str, SourceResult] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    def value(self, name: str, default=None):
+        result = self.sources.get(name)
+        return result.value if result is not None and result.ok else default
+
+    def status_text(self, name: str) -> str:
+        """ข้อความสถานะภาษาไทยสำหรับ create_error_message"""
+        result = self.sources.get(name)
+        if result is None or result.status in ("error", "empty", "pending"):
+            return "ล้มเหลว"
+        if result.status == "timeout":
+            return "หมดเวลา"
+        return "สำเร็จ"
+
+def _run_source(name: str, fn, future: Future) -> None:
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
-        response.raise_for_status()
-        print("✅ ส่งข้อมูลไปยัง Make Webhook สำเร็จ!")
-    except requests.exceptions.HTTPError as err:
-        print(f"❌ ERROR: Make Webhook (HTTP Error): {err}")
+        with span(f"acquire.{name}"):
+            value = fn()
+        future.set_result(value)
+    except BaseException as e:
+        future.set_exception(e)
+
+def acquire_sources(sources: dict, deadlines: dict[str, float] | None = None,
+                    overall_deadline: float = ACQUIRE_DEADLINE,
+                    cancel: threading.Event | None = None) -> AcquisitionResult:
+    """
+    รันทุกแหล่งข้อมูลพร้อมกันบน daemon thread แล้วรอผลไม่เกินกำหนดเวลาของแต่ละแหล่ง
+    และกำหนดเวลารวม แหล่งที่ไม่ทันจะได้สถานะ 'timeout' และ cancel จะถูก set
+    เพื่อให้งานที่ยังค้างหยุดในจังหวะถัดไป (thread ที่ค้างไม่ขวางการจบโปรแกรม)
+    """
+    deadlines = deadlines or {}
+    cancel = cancel or threading.Event()
+    started = time.perf_counter()
+    futures: dict[str, Future] = {}
+    finished: dict[str, float] = {}
+    for name, fn in sources.items():
+        future = Future()
+        future.add_done_callback(lambda _f, name=name: finished.setdefault(name, time.perf_counter() - started))
+        threading.Thread(target=_run_source, args=(name, fn, future), name=f"acquire-{name}", daemon=True).start()
+        futures[name] = future
+
+    result = AcquisitionResult()
+    for name, future in futures.items():
+        limit = min(deadlines.get(name, overall_deadline), overall_deadline)
+        remaining = max(0.0, limit - (time.perf_counter() - started))
+        source = SourceResult(name)
         try:
-            print(f"    Response: {err.response.text}")
-        except Exception:
-            pass
-    except Exception as e:
-        print(f"❌ ERROR: ส่งข้อมูลไปยัง Make Webhook (General Error): {e}")
+            value = future.result(timeout=remaining)
+            source.status = "ok" if value is not None else "empty"
+            source.value = value
+        except FutureTimeoutError:
+            source.status = "timeout"
+            source.error = f"เกินกำหนด {limit:.0f} วินาที"
+            count("source_timeouts", source=name)
+            cancel.set()
+        except Exception as e:
+            source.status = "error"
+            source.error = str(e)
+        source.elapsed = finished.get(name, time.perf_counter() - started)
+        result.sources[name] = source
+    result.elapsed = time.perf_counter() - started
+    for source in result.sources.values():
+        detail = f" ({source.error})" if source.error else ""
+        print(f"⏱️ {source.name}: {source.status} ใน {source.elapsed:.2f} วินาที{detail}")
+    return result
 
+_first_fetch_reported = False
 
-# --- Main ---
-if __name__ == "__main__":
-    print("=== เริ่มการทำงานระบบแจ้งเตือนน้ำอินทร์บุรี ===")
-    
-    inburi_cache_buster_url = f"{SINGBURI_URL}?cb={random.randint(10000, 99999)}"
-    
-    inburi_level, bank_level = get_inburi_data(inburi_cache_buster_url)
-    dam_discharge = fetch_chao_phraya_dam_discharge(DISCHARGE_URL)
-    
-    # ดึงข้อมูลย้อนหลังจาก Excel (ตามวันวันนี้)
-    hist_2567 = get_historical_from_excel(2567)
-    hist_2565 = get_historical_from_excel(2565)
-    hist_2554 = get_historical_from_excel(2554)
+def _report_time_to_first_fetch() -> None:
+    global _first_fetch_reported
+    if _first_fetch_reported:
+        return
+    _first_fetch_reported = True
+    elapsed = time.perf_counter() - PROCESS_STARTED
+    print(f"🚀 เวลาตั้งแต่เริ่มโปรแกรมจนเริ่มดึงข้อมูล: {elapsed:.3f} วินาที")
+    if METRICS_ENABLED:
+        _emit({"ts": time.time(), "type": "span", "name": "startup.time_to_first_fetch", "duration": round(elapsed, 6)})
 
-    if inburi_level is not None and bank_level is not None and dam_discharge is not None:
-        final_message = analyze_and_create_message(
-            inburi_level,
-            dam_discharge,
-            bank_level,
-            hist_2567=hist_2567,
-            hist_2565=hist_2565,
-            hist_2554=hist_2554,
+def acquire_all(overall_deadline: float = ACQUIRE_DEADLINE) -> AcquisitionResult:
+    """ดึงข้อมูลอินทร์บุรี เขื่อนเจ้าพระยา และข้อมูลย้อนหลังพร้อมกัน"""
+    _report_time_to_first_fetch()
+    cancel = threading.Event()
+    inburi_url = f"{SINGBURI_URL}?cb={random.randint(10000, 99999)}"
+
+    def inburi():
+        level, bank = get_inburi_data(inburi_url, timeout=INBURI_TIMEOUT, retries=INBURI_RETRIES, cancel=cancel)
+        return None if level is None or bank is None else (level, bank)
+
+    sources = {
+        "inburi": inburi,
+        "dam": lambda: fetch_chao_phraya_dam_discharge(DISCHARGE_URL),
+        # ดึงข้อมูลย้อนหลังจาก Excel (ตามวันวันนี้) โหลดดัชนีครั้งเดียวสำหรับทุกปี
+        "historical": lambda: get_historical_for_today(HIST_YEARS),
+    }
+    return acquire_sources(sources, SOURCE_DEADLINES, overall_deadline, cancel)
+
+# --- คลังข้อมูลการตรวจวัด (SQLite แบบ WAL) ---
+OBSERVATION_DB = os.environ.get('OBSERVATION_DB', 'data/observations.sqlite3')
+
+class ObservationStore:
+    """
+    คลังค่าที่ดึงได้ทุกครั้ง (append-only) แยกตามสถานี/ชนิดค่า
+    ใช้ตาราง WITHOUT ROWID ที่มีคีย์ (station, metric, ts) จึงค้นช่วงเวลาและ N ค่าล่าสุดด้วย index โดยตรง
+    ts เป็นเวลาแบบ Unix epoch (วินาที)
+    """
+
+    def __init__(self, path: str = OBSERVATION_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS observations ("
+            " station TEXT NOT NULL, metric TEXT NOT NULL, ts INTEGER NOT NULL, value REAL,"
+            " PRIMARY KEY (station, metric, ts)) WITHOUT ROWID"
+        )
+        # ไฟล์ข้อมูลย้อนหลังที่นำเข้าแล้ว (ดู ingest_archives)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested_files ("
+            " sha1 TEXT PRIMARY KEY, path TEXT NOT NULL, rows INTEGER NOT NULL, ts INTEGER NOT NULL)"
         )
+        self.conn.commit()
+
+    def append(self, station: str, metric: str, value: float | None, ts: float | None = None) -> None:
+        self.append_many([(station, metric, value, ts)])
+
+    def append_many(self, rows) -> int:
+        """เพิ่มหลายค่าใน transaction เดียว: rows เป็น (station, metric, value, ts) โดย ts=None คือเวลาปัจจุบัน"""
+        now = int(time.time())
+        records = [
+            (station, metric, int(now if ts is None else ts), value)
+            for station, metric, value, ts in rows
+            if value is not None
+        ]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?)", records)
+        return len(records)
+
+    def range(self, station: str, metric: str, start: float, end: float | None = None) -> list[tuple[int, float]]:
+        """คืนค่า [(ts, value), ...] ในช่วง start <= ts <= end เรียงตามเวลา"""
+        end = time.time() if end is None else end
+        return self.conn.execute(
+            "SELECT ts, value FROM observations WHERE station = ? AND metric = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (station, metric, int(start), int(end)),
+        ).fetchall()
+
+    def latest(self, station: str, metric: str, n: int = 1) -> list[tuple[int, float]]:
+        """คืนค่า N ค่าล่าสุด [(ts, value), ...] เรียงจากเก่าไปใหม่"""
+        rows = self.conn.execute(
+            "SELECT ts, value FROM observations WHERE station = ? AND metric = ? ORDER BY ts DESC LIMIT ?",
+            (station, metric, n),
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def is_ingested(self, sha1: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM ingested_files WHERE sha1 = ?", (sha1,)).fetchone() is not None
+
+    def mark_ingested(self, path: str, sha1: str, rows: int) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?, ?)",
+                              (sha1, path, rows, int(time.time())))
+
+    def close(self) -> None:
+        self.conn.close()
+
+def open_observation_store(path: str = OBSERVATION_DB) -> ObservationStore | None:
+    """เปิดคลังค่า ถ้าเปิดไม่ได้ (ไฟล์เสีย/ถูกล็อก/ไม่มีสิทธิ์) ให้คืน None แล้วแจ้งเตือนต่อโดยไม่ใช้คลัง"""
+    try:
+        return ObservationStore(path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ เปิดคลังค่า {path} ไม่สำเร็จ ทำงานต่อโดยไม่บันทึก/ไม่ใช้ค่าย้อนหลัง: {e!r}")
+        count("errors", stage="store")
+        return None
+
+def record_observations(store: ObservationStore | None, acquisition: AcquisitionResult, ts: float | None = None,
+                        stations=()) -> int:
+    """
+    บันทึกค่าของรอบนี้ลงคลัง: อินทร์บุรีและสถานีที่มีผู้ติดตาม (stations), เขื่อนเจ้าพระยา และค่าย้อนหลัง
+    ระดับตลิ่งแทบไม่เปลี่ยน จึงบันทึกเฉพาะเมื่อต่างจากค่าล่าสุดในคลัง
+    """
+    if store is None:
+        return 0
+    ts = time.time() if ts is None else ts
+    readings = {}
+    if acquisition.value("inburi") is not None and last_station_table is not None:
+        for station in stations:
+            row = last_station_table.get(station)
+            if row is not None:
+                readings[observation_key(row["name"])] = (row["level"], row["bank"])
+    readings[INBURI_STATION_NAME] = acquisition.value("inburi", (None, None))
+    rows = []
+    try:
+        for key, (level, bank) in readings.items():
+            rows.append((key, "level", level, ts))
+            if bank is not None and [value for _, value in store.latest(key, "bank")] != [bank]:
+                rows.append((key, "bank", bank, ts))
+        rows.append(("C13", "discharge", acquisition.value("dam"), ts))
+        for year, value in (acquisition.value("historical") or {}).items():
+            rows.append(("historical", f"discharge_{year}", value, ts))
+        with span("store.append"):
+            written = store.append_many(rows)
+        print(f"🗄️ บันทึก {written} ค่าลงคลังข้อมูล ({store.path})")
+        return written
+    except sqlite3.Error as e:
+        print(f"⚠️ บันทึกลงคลังข้อมูลไม่สำเร็จ: {e}")
+        return 0
+
+# --- นำเข้าไฟล์ข้อมูลย้อนหลังขนาดใหญ่เข้าคลัง (ทีละแถว, ข้ามไฟล์ที่ไม่เปลี่ยน) ---
+ARCHIVE_STATION = "C13"  # ข้อมูลย้อนหลังทั้งหมดเป็นปริมาณน้ำปล่อยเขื่อนเจ้าพระยา
+ARCHIVE_METRIC = "discharge"
+ARCHIVE_SUFFIXES = (".xlsx", ".csv")
+INGEST_BATCH = 5000
+BANGKOK_TZ = timezone(timedelta(hours=7))
+
+def _archive_paths(paths: list[str]):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                # ข้ามไฟล์ล็อกชั่วคราวของ Excel (~$...)
+                if name.lower().endswith(ARCHIVE_SUFFIXES) and not name.startswith("~$"):
+                    yield os.path.join(root, name)
+
+def ingest_archives(paths: list[str], store: ObservationStore, batch_size: int = INGEST_BATCH) -> dict[str, int]:
+    """
+    นำเข้าไฟล์ข้อมูลย้อนหลัง (.xlsx/.csv หรือโฟลเดอร์) เข้า ObservationStore เป็น (C13, discharge, ts)
+    อ่านทีละแถว (iter_discharge_records) และเขียนทีละ batch หน่วยความจำจึงคงที่ไม่ว่าไฟล์จะใหญ่เท่าไร
+    ไฟล์ที่ sha1 ตรงกับไฟล์ที่เคยนำเข้าแล้วจะถูกข้าม คืนค่า {"files", "skipped", "rows"}
+    """
+    stats = {"files": 0, "skipped": 0, "rows": 0}
+    for path in _archive_paths(paths):
+        sha1 = _file_sha1(path)
+        if store.is_ingested(sha1):
+            stats["skipped"] += 1
+            continue
+        written = 0
+        batch = []
+        with span("ingest.file", path=path) as sp:
+            for when, value in iter_discharge_records(path):
+                batch.append((ARCHIVE_STATION, ARCHIVE_METRIC, value, when.replace(tzinfo=BANGKOK_TZ).timestamp()))
+                if len(batch) >= batch_size:
+                    written += store.append_many(batch)
+                    batch = []
+            written += store.append_many(batch)
+            sp.set(rows=written)
+        # บันทึกหลังเขียนครบทั้งไฟล์ หากหยุดกลางทางรอบหน้าจะนำเข้าใหม่ (แถวเดิมถูกแทนที่ด้วยคีย์เดียวกัน)
+        store.mark_ingested(path, sha1, written)
+        print(f"📥 นำเข้า {path}: {written:,} แถว")
+        stats["files"] += 1
+        stats["rows"] += written
+    count("ingest_rows", stats["rows"])
+    return stats
+
+# --- สร้างรายงานและส่งแจ้งเตือน ---
+def _optional(name: str, fn, *args, **kwargs):
+    """แนวโน้มและ analogue เป็นส่วนเสริม: หากผิดพลาดคืนค่า None เพื่อให้ข้อความหลักยังส่งได้เสมอ"""
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        print(f"⚠️ คำนวณ{name}ไม่สำเร็จ ข้ามส่วนนี้: {e!r}")
+        count("errors", stage=name)
+        return None
+
+def build_report(acquisition: AcquisitionResult, store: ObservationStore | None = None):
+    """
+    สร้างข้อความแจ้งเตือนจากผลการดึงข้อมูล (และแนวโน้มจากคลังข้อมูลหากระบุ store)
+    คืนค่า (ข้อความ, ข้อมูลเพิ่มเติมสำหรับ Make Webhook, ระดับการเตือน หรือ 'error')
+    """
+    inburi_level, bank_level = acquisition.value("inburi", (None, None))
+    dam_discharge = acquisition.value("dam")
+    historical = acquisition.value("historical", {})
+    hist_2567 = historical.get(2567)
+    hist_2565 = historical.get(2565)
+    hist_2554 = historical.get(2554)
+
+    if inburi_level is not None and bank_level is not None and dam_discharge is not None:
+        with span("analyze"):
+            trend = _optional("แนวโน้ม", station_trend, store, INBURI_STATION_NAME, bank=bank_level) if store is not None else None
+            analogues = _optional("analogue", discharge_analogues, store) if store is not None else None
+            tier = classify_alert(inburi_level, dam_discharge, bank_level, trend)
+            final_message = analyze_and_create_message(
+                inburi_level,
+                dam_discharge,
+                bank_level,
+                hist_2567=hist_2567,
+                hist_2565=hist_2565,
+                hist_2554=hist_2554,
+                trend=trend,
+                analogues=analogues,
+            )
     else:
-        inburi_status = "สำเร็จ" if inburi_level is not None else "ล้มเหลว"
-        discharge_status = "สำเร็จ" if dam_discharge is not None else "ล้มเหลว"
+        tier = "error"
+        inburi_status = acquisition.status_text("inburi")
+        discharge_status = acquisition.status_text("dam")
         final_message = create_error_message(inburi_status, discharge_status)
 
-    print("\n📤 ข้อความที่จะแจ้งเตือน:")
-    print(final_message)
-    # ส่งข้อความไปยัง LINE
-    print("\n🚀 ส่งข้อความไปยัง LINE…")
-    send_line_push(final_message)
     # เตรียมข้อมูลเพิ่มเติมสำหรับ Make Webhook
     extra_payload = {
         "inburi_level": inburi_level,
@@ -412,7 +2118,411 @@ if __name__ == "__main__":
         "hist_2565": hist_2565,
         "hist_2554": hist_2554,
     }
-    # ส่งข้อความและข้อมูลเพิ่มเติมไปยัง Make Webhook หากกำหนด URL ไว้
-    print("\n🔗 ส่งข้อความไปยัง Make Webhook…")
-    send_make_webhook(final_message, extra_data=extra_payload)
-print("✅ เสร็จสิ้นการทำงาน")
+    return final_message, extra_payload, tier
+
+def send_notifications(final_message: str, extra_payload: dict) -> dict[str, int]:
+    # ส่งข้อความไปยัง LINE และ Make Webhook (หากกำหนด URL ไว้) พร้อมกัน
+    print("\n🚀 ส่งข้อความไปยัง LINE และ Make Webhook…")
+    counts = dispatch(line_deliveries(final_message) + webhook_deliveries(final_message, extra_payload))
+    print(f"📮 ส่งสำเร็จ {counts['sent']}, ล้มเหลวถาวร {counts['dropped']}, ค้างในคิว {counts['failed']}")
+    return counts
+
+# --- ผู้รับหลายกลุ่ม: ดึงข้อมูลครั้งเดียว ประเมินเกณฑ์ของทุกกลุ่มจากข้อมูลชุดเดียวกัน ---
+SUBSCRIPTIONS_PATH = os.environ.get('SUBSCRIPTIONS', 'subscriptions.json')
+DAM_STATION = "C13"
+# template ของกลุ่มที่ไม่ได้ใช้ข้อความมาตรฐาน ใช้ str.format กับคีย์:
+#   {icon} {header} {advice} {tier} {timestamp} {stations} {dam_station} {discharge} {name}
+STATION_LINE_TEMPLATE = "  • {icon} {station}: {level:.2f} ม.รทก. (ตลิ่ง {bank:.2f}, ต่ำกว่า {distance:.2f} ม.)"
+MISSING_STATION_LINE_TEMPLATE = "  • ❔ {station}: ไม่มีข้อมูลในรอบนี้"
+SUBSCRIBER_TEMPLATE = (
+    "{icon} {header}\n\n📍 รายงานสถานการณ์น้ำ ({name})\n🗓️ วันที่: {timestamp} น.\n\n"
+    "🌊 ระดับน้ำ + ระดับตลิ่ง\n{stations}\n\n💧 ปริมาณน้ำ {dam_station}\n  {discharge:,.0f} ลบ.ม./วินาที\n\n{advice}"
+)
+_TIER_ORDER = {"green": 0, "yellow": 1, "red": 2}
+
+@dataclass
+class Subscriber:
+    """
+    ผู้รับหนึ่งกลุ่ม: สถานีที่ติดตาม เกณฑ์ (ทับ ALERT_THRESHOLDS) ปลายทาง LINE/Make และ template
+    template=None กับสถานีเดียวและเขื่อน C13 จะใช้ข้อความมาตรฐาน (analyze_and_create_message)
+    """
+    name: str
+    stations: list[str] = field(default_factory=lambda: [INBURI_STATION_NAME])
+    line_groups: list[str] = field(default_factory=list)
+    webhooks: list[str] = field(default_factory=list)
+    thresholds: dict = field(default_factory=dict)
+    dam_station: str = DAM_STATION
+    template: str | None = None
+
+# ค่าตัวอย่างของทุกคีย์ที่ template ใช้ได้ (ดู SUBSCRIBER_TEMPLATE) สำหรับตรวจ template ตอนโหลด
+_TEMPLATE_SAMPLE = {
+    "icon": "🟩", "header": "", "advice": "", "tier": "green", "timestamp": "01/01/2567 00:00",
+    "stations": "", "dam_station": DAM_STATION, "discharge": 0.0, "name": "",
+}
+
+def _template_error(template: str) -> str | None:
+    """คืนข้อความ error หาก template มีคีย์ที่ไม่รู้จักหรือรูปแบบผิด มิฉะนั้นคืน None"""
+    try:
+        template.format(**_TEMPLATE_SAMPLE)
+    except KeyError as e:
+        return f"ไม่รู้จักคีย์ {e}"
+    except (IndexError, ValueError) as e:
+        return str(e)
+    return None
+
+def load_subscriptions(path: str = SUBSCRIPTIONS_PATH) -> list[Subscriber]:
+    """
+    อ่าน subscriptions.json: {"subscribers": [{"name": ..., "stations": [...], "line_groups": [...],
+    "webhooks": [...], "thresholds": {...}, "dam_station": "C13", "template": "..." หรือ path ของไฟล์ .txt}]}
+    คืนค่าลิสต์ว่างหากไม่มีไฟล์ (ใช้ LINE_GROUP_IDS / MAKE_WEBHOOK_URLS แบบเดิม) ดูตัวอย่างใน subscriptions.example.json
+    payload ของ webhook: subscriber, tier, dam_station, dam_discharge, stations, missing_stations
+    และกลุ่มที่ใช้ข้อความมาตรฐานมีคีย์เดิมด้วย (inburi_level, bank_level, hist_2567/2565/2554)
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    subscribers = []
+    for item in data.get("subscribers", []):
+        unknown = set(item.get("thresholds", {})) - set(ALERT_THRESHOLDS)
+        if unknown:
+            print(f"⚠️ กลุ่ม {item.get('name')}: ไม่รู้จักเกณฑ์ {', '.join(sorted(unknown))}")
+        template = item.get("template")
+        if template and template.endswith(".txt"):
+            # path ที่ไม่มีอยู่จริงต้องไม่ถูกส่งออกไปเป็นข้อความ
+            if not os.path.exists(template):
+                raise FileNotFoundError(f"กลุ่ม {item.get('name')}: ไม่พบไฟล์ template {template}")
+            with open(template, encoding="utf-8") as f:
+                template = f.read()
+        if template:
+            error = _template_error(template)
+            if error:
+                print(f"⚠️ ข้ามกลุ่ม {item.get('name')}: template ใช้ไม่ได้ ({error})")
+                continue
+        subscribers.append(Subscriber(
+            name=item["name"],
+            stations=item.get("stations") or [INBURI_STATION_NAME],
+            line_groups=item.get("line_groups", []),
+            webhooks=item.get("webhooks", []),
+            thresholds={k: float(v) for k, v in item.get("thresholds", {}).items() if k in ALERT_THRESHOLDS},
+            dam_station=item.get("dam_station", DAM_STATION),
+            template=template,
+        ))
+    return subscribers
+
+class Snapshot:
+    """
+    ข้อมูลของรอบนี้ที่ทุกกลุ่มใช้ร่วมกัน: ตารางสถานี ปริมาณน้ำทุกสถานีของเขื่อน และค่าย้อนหลัง
+    แนวโน้มของแต่ละสถานีและ analogue ของเขื่อนคำนวณเมื่อมีกลุ่มใช้ครั้งแรกแล้วจำไว้
+    """
+
+    def __init__(self, acquisition: AcquisitionResult, store: ObservationStore | None = None):
+        self.acquisition = acquisition
+        self.store = store
+        # ใช้ตารางของรอบนี้เท่านั้น (รอบที่ดึงไม่สำเร็จ ตารางของรอบก่อนอาจยังค้างอยู่)
+        self.stations = last_station_table if acquisition.value("inburi") is not None else None
+        self.dam = dict(last_dam_stations) if acquisition.value("dam") is not None else {}
+        if acquisition.value("dam") is not None:
+            self.dam.setdefault(DAM_STATION, acquisition.value("dam"))
+        self.historical = acquisition.value("historical", {}) or {}
+        self._trends: dict[str, dict | None] = {}
+        self._analogues = None
+
+    def reading(self, station: str):
+        """(ชื่อเต็ม, ระดับน้ำ, ระดับตลิ่ง) หรือ None หากไม่มีค่า"""
+        if station_key(station) == INBURI_STATION_NAME:
+            level, bank = self.acquisition.value("inburi", (None, None))
+            return (station, level, bank) if level is not None else None
+        row = self.stations.get(station) if self.stations is not None else None
+        if row is None or row["level"] is None or row["bank"] is None:
+            return None
+        return row["name"], row["level"], row["bank"]
+
+    def trend(self, station: str, bank: float) -> dict | None:
+        key = observation_key(station)
+        if key not in self._trends:
+            self._trends[key] = _optional("แนวโน้ม", station_trend, self.store, key, bank=bank) if self.store is not None else None
+        return self._trends[key]
+
+    def analogues(self) -> list[dict] | None:
+        if self._analogues is None and self.store is not None:
+            self._analogues = _optional("analogue", discharge_analogues, self.store) or []
+        return self._analogues
+
+def _standard_message(sub: Subscriber) -> bool:
+    """เลือกแบบข้อความจากการตั้งค่าของกลุ่ม (ไม่ขึ้นกับว่ารอบนี้มีข้อมูลสถานีใดบ้าง)"""
+    return sub.template is None and len(sub.stations) == 1 and sub.dam_station == DAM_STATION
+
+def _render_subscriber(sub: Subscriber, snapshot: Snapshot, readings: list, absent: list[str],
+                       discharge: float, tier: str) -> str:
+    if _standard_message(sub):
+        (station, level, bank, trend, _), = readings
+        historical = snapshot.historical
+        return analyze_and_create_message(
+            level, discharge, bank,
+            hist_2567=historical.get(2567), hist_2565=historical.get(2565), hist_2554=historical.get(2554),
+            trend=trend, analogues=snapshot.analogues(),
+            station=station_key(station), thresholds=sub.thresholds,
+        )
+    icon, header, advice = TIER_TEXT[tier]
+    lines = [
+        STATION_LINE_TEMPLATE.format(icon=TIER_TEXT[station_tier][0], station=station_key(station),
+                                     level=level, bank=bank, distance=bank - level)
+        for station, level, bank, _, station_tier in readings
+    ]
+    lines += [MISSING_STATION_LINE_TEMPLATE.format(station=station) for station in absent]
+    return (sub.template or SUBSCRIBER_TEMPLATE).format(
+        icon=icon, header=header, advice=advice, tier=tier, name=sub.name,
+        timestamp=datetime.now(pytz.timezone('Asia/Bangkok')).strftime('%d/%m/%Y %H:%M'),
+        stations="\n".join(lines), dam_station=sub.dam_station, discharge=discharge,
+    )
+
+def _subscriber_error(sub: Subscriber, acquisition: AcquisitionResult, absent: list[str],
+                      discharge: float | None) -> str:
+    """ข้อความ error ที่ระบุสถานี/เขื่อนของกลุ่มที่ไม่มีข้อมูลในรอบนี้"""
+    inburi = acquisition.status_text("inburi")
+    station_status = inburi if inburi != "สำเร็จ" else "ไม่มีข้อมูลสถานีนี้ในรอบนี้"
+    statuses = [(f"ระดับน้ำ{station}", station_status) for station in absent]
+    if discharge is None:
+        dam = acquisition.status_text("dam")
+        label = "เขื่อนเจ้าพระยา" if sub.dam_station == DAM_STATION else f"ปริมาณน้ำ {sub.dam_station}"
+        statuses.append((label, dam if dam != "สำเร็จ" else "ไม่มีข้อมูลสถานีนี้ในรอบนี้"))
+    return create_error_message(None, None, statuses)
+
+def evaluate_subscribers(subscribers: list[Subscriber], acquisition: AcquisitionResult,
+                         store: ObservationStore | None = None) -> list[tuple[Subscriber, str, str, dict]]:
+    """
+    ประเมินทุกกลุ่มจากข้อมูลชุดเดียวกัน คืนค่า [(กลุ่ม, ระดับการเตือน, ข้อความ, payload), ...]
+    ข้อความถูกสร้างครั้งเดียวต่อชุดข้อมูลที่ต่างกัน กลุ่มที่เห็นข้อมูลและระดับเดียวกันใช้ข้อความร่วมกัน
+    """
+    snapshot = Snapshot(acquisition, store)
+    rendered: dict[tuple, str] = {}
+    missing: set[str] = set()
+    results = []
+    with span("subscribers.evaluate", subscribers=len(subscribers)) as sp:
+        for sub in subscribers:
+            discharge = snapshot.dam.get(sub.dam_station)
+            readings, absent = [], []
+            for station in sub.stations:
+                reading = snapshot.reading(station)
+                if reading is None:
+                    absent.append(station)
+                    if station not in missing:
+                        missing.add(station)
+                        print(f"⚠️ ไม่มีข้อมูลสถานี {station} ในรอบนี้")
+                    continue
+                name, level, bank = reading
+                trend = snapshot.trend(name, bank)
+                readings.append((name, level, bank, trend,
+                                 classify_alert(level, discharge, bank, trend, sub.thresholds) if discharge is not None else None))
+            payload = {
+                "subscriber": sub.name,
+                "dam_station": sub.dam_station,
+                "dam_discharge": discharge,
+                "stations": {station_key(r[0]): {"level": r[1], "bank": r[2], "tier": r[4]} for r in readings},
+                "missing_stations": absent,
+            }
+            if _standard_message(sub):
+                # กลุ่มที่ใช้ข้อความมาตรฐานคงคีย์เดิมของ build_report ไว้ด้วย ไม่ให้ scenario ของ Make เดิมพัง
+                (_, level, bank, _, _), = readings or [(None, None, None, None, None)]
+                payload.update({
+                    "inburi_level": level,
+                    "bank_level": bank,
+                    "hist_2567": snapshot.historical.get(2567),
+                    "hist_2565": snapshot.historical.get(2565),
+                    "hist_2554": snapshot.historical.get(2554),
+                })
+            if discharge is None or not readings:
+                tier = "error"
+                key = ("error", tuple(absent), None if discharge is not None else sub.dam_station)
+                if key not in rendered:
+                    rendered[key] = _subscriber_error(sub, acquisition, absent, discharge)
+            else:
+                tier = max((r[4] for r in readings), key=_TIER_ORDER.__getitem__)
+                # ชื่อกลุ่มเป็นส่วนหนึ่งของคีย์เฉพาะเมื่อ template ใช้ {name}
+                template = None if _standard_message(sub) else sub.template or SUBSCRIBER_TEMPLATE
+                key = (template, sub.name if template and "{name" in template else None, sub.dam_station,
+                       discharge, tier, tuple((r[0], r[1], r[2], r[4]) for r in readings), tuple(absent))
+                if key not in rendered:
+                    rendered[key] = _render_subscriber(sub, snapshot, readings, absent, discharge, tier)
+            payload["tier"] = tier
+            results.append((sub, tier, rendered[key], payload))
+        sp.set(messages=len(rendered))
+    print(f"🧾 สร้างข้อความ {len(rendered)} แบบ สำหรับ {len(subscribers)} กลุ่ม")
+    return results
+
+def subscriber_deliveries(sub: Subscriber, message: str, payload: dict) -> list[dict]:
+    deliveries = line_deliveries(message, sub.line_groups) if sub.line_groups else []
+    if sub.webhooks:
+        deliveries += webhook_deliveries(message, payload, sub.webhooks)
+    return deliveries
+
+def send_subscriber_notifications(results: list[tuple[Subscriber, str, str, dict]],
+                                  last_sent: dict[str, dict] | None = None) -> dict[str, dict]:
+    """
+    ส่งข้อความของทุกกลุ่มใน dispatch เดียว (ใช้โควตาการส่งร่วมกัน)
+    หากระบุ last_sent (โหมด daemon) จะส่งเฉพาะกลุ่มที่ should_notify_subscriber เป็นจริง
+    คืนค่า last_sent ที่อัปเดตแล้ว {ชื่อกลุ่ม: {"tier", "payload"}}
+    """
+    last_sent = {} if last_sent is None else last_sent
+    deliveries = []
+    for sub, tier, message, payload in results:
+        if sub.name in last_sent and not should_notify_subscriber(last_sent[sub.name], tier, payload):
+            continue
+        deliveries += subscriber_deliveries(sub, message, payload)
+        last_sent[sub.name] = {"tier": tier, "payload": payload}
+    if deliveries:
+        print(f"\n🚀 ส่งข้อความ {len(deliveries)} รายการ ไปยัง {len(results)} กลุ่ม…")
+        counts = dispatch(deliveries)
+        print(f"📮 ส่งสำเร็จ {counts['sent']}, ล้มเหลวถาวร {counts['dropped']}, ค้างในคิว {counts['failed']}")
+    else:
+        print("💤 ไม่มีกลุ่มที่ต้องแจ้งเตือนในรอบนี้")
+        dispatch([])  # ลองส่งข้อความที่ค้างในคิวจากรอบก่อน
+    return last_sent
+
+# --- โหมด daemon (ทำงานต่อเนื่องช่วงน้ำหลาก) ---
+DAEMON_INTERVAL = float(os.environ.get('DAEMON_INTERVAL', '300'))
+LEVEL_ALERT_DELTA = float(os.environ.get('LEVEL_ALERT_DELTA', '0.25'))          # เมตร
+DISCHARGE_ALERT_DELTA = float(os.environ.get('DISCHARGE_ALERT_DELTA', '200'))  # ลบ.ม./วินาที
+
+def _percentile(values: list[float], pct: float) -> float:
+    """เปอร์เซ็นไทล์แบบ nearest-rank (ใช้ร่วมกับ harness.py ให้ตัวเลขตรงกัน)"""
+    if not values:
+        return NAN
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, ceil(len(ordered) * pct / 100))) - 1]
+
+def should_notify(last: dict | None, tier: str, extra_payload: dict,
+                  level_delta: float = LEVEL_ALERT_DELTA,
+                  discharge_delta: float = DISCHARGE_ALERT_DELTA) -> bool:
+    """ส่งแจ้งเตือนเมื่อเป็นรอบแรก ระดับการเตือนเปลี่ยน หรือค่าเปลี่ยนเกิน delta ที่กำหนด"""
+    if last is None or last["tier"] != tier:
+        return True
+    for key, delta in (("inburi_level", level_delta), ("dam_discharge", discharge_delta)):
+        prev, cur = last["payload"].get(key), extra_payload.get(key)
+        if prev is not None and cur is not None and abs(cur - prev) >= delta:
+            return True
+    return False
+
+def should_notify_subscriber(last: dict, tier: str, payload: dict) -> bool:
+    """เหมือน should_notify แต่เทียบระดับน้ำของทุกสถานีที่กลุ่มติดตาม"""
+    if should_notify(last, tier, payload):
+        return True
+    previous = last["payload"].get("stations", {})
+    for station, current in payload.get("stations", {}).items():
+        prev = previous.get(station)
+        if prev is None or prev["tier"] != current["tier"] or abs(current["level"] - prev["level"]) >= LEVEL_ALERT_DELTA:
+            return True
+    return False
+
+def _report_and_notify(acquisition: AcquisitionResult, store: ObservationStore | None, last_sent: dict | None,
+                       subscribers: list[Subscriber] | None = None) -> dict | None:
+    if subscribers:
+        return send_subscriber_notifications(evaluate_subscribers(subscribers, acquisition, store), last_sent)
+    final_message, extra_payload, tier = build_report(acquisition, store)
+    if should_notify(last_sent, tier, extra_payload):
+        print(f"📤 ระดับการเตือน: {tier} — ส่งแจ้งเตือน")
+        send_notifications(final_message, extra_payload)
+        return {"tier": tier, "payload": extra_payload}
+    print(f"💤 ระดับการเตือน: {tier} — ไม่มีการเปลี่ยนแปลงที่ต้องแจ้ง")
+    dispatch([])  # ลองส่งข้อความที่ค้างในคิวจากรอบก่อน
+    return last_sent
+
+def run_daemon(interval: float = DAEMON_INTERVAL, max_cycles: int | None = None) -> None:
+    """
+    วนดึงข้อมูลทุก interval วินาที โดยใช้ http_session และ Chrome ตัวเดิมข้ามรอบ
+    ส่ง LINE/Make เฉพาะเมื่อ should_notify() เป็นจริง และพิมพ์สถิติเวลาต่อรอบ
+    """
+    global KEEP_DRIVER
+    KEEP_DRIVER = True
+    store = open_observation_store()
+    subscribers = load_subscriptions()
+    if subscribers:
+        print(f"👥 ผู้รับ {len(subscribers)} กลุ่มจาก {SUBSCRIPTIONS_PATH}")
+    observed = {station for sub in subscribers or () for station in sub.stations}
+    last_sent = None
+    last_values = None
+    latencies: deque[float] = deque(maxlen=288)
+    cycle = 0
+    try:
+        while max_cycles is None or cycle < max_cycles:
+            cycle += 1
+            started = time.perf_counter()
+            print(f"\n=== รอบที่ {cycle} ===")
+            with span("cycle", cycle=cycle):
+                acquisition = acquire_all()
+                values = (acquisition.value("inburi"), acquisition.value("dam"))
+                if values == last_values and None not in values:
+                    # ต้นทางยังไม่อัปเดต ไม่ต้องบันทึก/วิเคราะห์ซ้ำ
+                    print("💤 ไม่มีข้อมูลใหม่จากต้นทาง ข้ามการวิเคราะห์รอบนี้")
+                    # แต่ข้อความที่ค้างในคิวจากรอบก่อนต้องลองส่งต่อทุกรอบ
+                    dispatch([])
+                else:
+                    last_values = values
+                    record_observations(store, acquisition, stations=observed)
+                    last_sent = _report_and_notify(acquisition, store, last_sent, subscribers)
+            write_metrics()
+            latencies.append(time.perf_counter() - started)
+            print(
+                f"📊 เวลาต่อรอบ: ล่าสุด {latencies[-1]:.2f}s, p50 {_percentile(latencies, 50):.2f}s, "
+                f"p95 {_percentile(latencies, 95):.2f}s, สูงสุด {max(latencies):.2f}s ({len(latencies)} รอบ)"
+            )
+            print(
+                f"🗃️ HTTP cache เขื่อน: 304 {fetch_cache_stats['not_modified']}, "
+                f"hash เดิม {fetch_cache_stats['unchanged']}, ดึงใหม่ {fetch_cache_stats['miss']}"
+            )
+            if max_cycles is None or cycle < max_cycles:
+                time.sleep(max(0.0, interval - latencies[-1]))
+    except KeyboardInterrupt:
+        print("⏹️ หยุดโหมด daemon")
+    finally:
+        KEEP_DRIVER = False
+        _close_driver(_shared_driver, broken=True)
+        if store is not None:
+            store.close()
+
+# --- Main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ระบบแจ้งเตือนน้ำอินทร์บุรี")
+    parser.add_argument("--daemon", action="store_true", help="ทำงานต่อเนื่องและแจ้งเตือนเมื่อสถานการณ์เปลี่ยน")
+    parser.add_argument("--interval", type=float, default=DAEMON_INTERVAL, help="ระยะห่างระหว่างรอบ (วินาที)")
+    parser.add_argument("--metrics-summary", metavar="JSONL", help="สรุป p50/p95/p99 ของแต่ละขั้นตอนจากไฟล์ metrics แล้วจบ")
+    parser.add_argument("--ingest", nargs="+", metavar="PATH", help="นำเข้าไฟล์/โฟลเดอร์ข้อมูลย้อนหลัง (.xlsx/.csv) เข้าคลังแล้วจบ")
+    args = parser.parse_args()
+
+    if args.ingest:
+        store = ObservationStore()
+        stats = ingest_archives(args.ingest, store)
+        store.close()
+        print(f"✅ นำเข้า {stats['files']} ไฟล์ ({stats['rows']:,} แถว), ข้าม {stats['skipped']} ไฟล์ที่ไม่เปลี่ยน")
+        raise SystemExit(0)
+
+    if args.metrics_summary:
+        for stage, stats in summarize_metrics(args.metrics_summary).items():
+            print(f"{stage}: n={stats['count']} p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s "
+                  f"p99={stats['p99']:.3f}s max={stats['max']:.3f}s")
+        raise SystemExit(0)
+
+    print("=== เริ่มการทำงานระบบแจ้งเตือนน้ำอินทร์บุรี ===")
+    if args.daemon:
+        run_daemon(args.interval)
+    else:
+        with span("run"):
+            acquisition = acquire_all()
+            store = open_observation_store()
+            subscribers = load_subscriptions()
+            record_observations(store, acquisition, stations={station for sub in subscribers or () for station in sub.stations})
+            if subscribers:
+                results = evaluate_subscribers(subscribers, acquisition, store)
+            else:
+                final_message, extra_payload, _tier = build_report(acquisition, store)
+            if store is not None:
+                store.close()
+            if subscribers:
+                send_subscriber_notifications(results)
+            else:
+                print("\n📤 ข้อความที่จะแจ้งเตือน:")
+                print(final_message)
+                send_notifications(final_message, extra_payload)
+        write_metrics()
+    print("✅ เสร็จสิ้นการทำงาน")
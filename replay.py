@@ -0,0 +1,193 @@
+import argparse
+import bisect
+import csv
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import main
+
+# --- ค่าคงที่ ---
+# ชื่อไฟล์ต้องมีเวลาที่บันทึก เช่น singburi_20261017T0700.html, chaopraya_20261017T0655.php
+TIMESTAMP_RE = re.compile(r"(\d{8})[T_-]?(\d{4})(\d{2})?")
+SINGBURI_PREFIX = "singburi"
+CHAOPRAYA_PREFIX = "chaopraya"
+FIELDS = ["timestamp", "inburi_level", "bank_level", "dam_discharge", "distance_to_bank", "tier",
+          "singburi_file", "chaopraya_file", "message", "error"]
+
+def snapshot_time(name: str) -> datetime | None:
+    """อ่านเวลาจากชื่อไฟล์ (YYYYmmddTHHMM[SS])"""
+    match = TIMESTAMP_RE.search(name)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1) + match.group(2) + (match.group(3) or "00"), "%Y%m%d%H%M%S")
+
+def collect_snapshots(folder: str) -> list[tuple[datetime, str, str | None]]:
+    """
+    จับคู่หน้า singburi แต่ละไฟล์กับคำตอบ chaopraya.php ล่าสุดที่ไม่ใหม่กว่าหน้านั้น
+    คืนค่า [(เวลา, ไฟล์ singburi, ไฟล์ chaopraya หรือ None), ...] เรียงตามเวลา
+    """
+    singburi, chaopraya = [], []
+    for entry in os.scandir(folder):
+        if not entry.is_file():
+            continue
+        ts = snapshot_time(entry.name)
+        if ts is None:
+            continue
+        if entry.name.startswith(SINGBURI_PREFIX):
+            singburi.append((ts, entry.path))
+        elif entry.name.startswith(CHAOPRAYA_PREFIX):
+            chaopraya.append((ts, entry.path))
+    singburi.sort()
+    chaopraya.sort()
+    dam_times = [ts for ts, _ in chaopraya]
+    pairs = []
+    for ts, path in singburi:
+        i = bisect.bisect_right(dam_times, ts) - 1
+        pairs.append((ts, path, chaopraya[i][1] if i >= 0 else None))
+    return pairs
+
+# คำตอบ chaopraya.php หนึ่งไฟล์มักถูกจับคู่กับหลาย snapshot ติดกัน จึงจำผลล่าสุดไว้ในแต่ละ process
+_last_dam: tuple[str, float | None] | None = None
+
+def _dam_discharge(path: str) -> float | None:
+    global _last_dam
+    if _last_dam is not None and _last_dam[0] == path:
+        return _last_dam[1]
+    with open(path, encoding="utf-8") as f:
+        table = main.parse_discharge_table(f.read())
+    value = table.get("C13", "storage") if table is not None else None
+    _last_dam = (path, value if isinstance(value, float) else None)
+    return _last_dam[1]
+
+def evaluate_snapshot(task: tuple[datetime, str, str | None], with_message: bool = False) -> dict:
+    """
+    อ่านไฟล์คู่หนึ่งด้วย parser ตัวเดียวกับ main.py แล้วจัดระดับการเตือนด้วย classify_alert
+    with_message=True จะสร้างข้อความด้วย analyze_and_create_message เก็บไว้ในคอลัมน์ message ด้วย
+    """
+    ts, singburi_path, chaopraya_path = task
+    error = None
+    try:
+        with open(singburi_path, encoding="utf-8") as f:
+            text = f.read()
+        if singburi_path.endswith(".json"):
+            level, bank = main.parse_inburi_json(json.loads(text))
+        else:
+            level, bank = main.parse_inburi_html(text)
+        discharge = _dam_discharge(chaopraya_path) if chaopraya_path is not None else None
+    except Exception as e:
+        # ไฟล์ในคลังอาจเป็นหน้าปิดปรับปรุงหรือดาวน์โหลดไม่ครบ: บันทึกเป็นแถว error แล้วทำต่อ
+        level = bank = discharge = None
+        error = f"{type(e).__name__}: {e}"
+    if level is None or bank is None or discharge is None:
+        tier, distance, message = "error", None, None
+    else:
+        tier, distance = main.classify_alert(level, discharge, bank), round(bank - level, 3)
+        # ลงเวลาในข้อความด้วยเวลาของ snapshot (ไม่ใช่เวลาที่เล่นซ้ำ)
+        message = main.analyze_and_create_message(level, discharge, bank, now=ts) if with_message else None
+    return {
+        "timestamp": ts.isoformat(timespec="minutes"),
+        "inburi_level": level,
+        "bank_level": bank,
+        "dam_discharge": discharge,
+        "distance_to_bank": distance,
+        "tier": tier,
+        "singburi_file": os.path.basename(singburi_path),
+        "chaopraya_file": os.path.basename(chaopraya_path) if chaopraya_path else None,
+        "message": message,
+        "error": error,
+    }
+
+class _ParquetSink:
+    """เขียน Parquet ทีละ batch (ต้องติดตั้ง pyarrow)"""
+
+    def __init__(self, path: str, batch_size: int = 5000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("timestamp", pa.string()), ("inburi_level", pa.float64()), ("bank_level", pa.float64()),
+            ("dam_discharge", pa.float64()), ("distance_to_bank", pa.float64()), ("tier", pa.string()),
+            ("singburi_file", pa.string()), ("chaopraya_file", pa.string()), ("message", pa.string()),
+            ("error", pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch: list[dict] = []
+        self.batch_size = batch_size
+
+    def write(self, row: dict) -> None:
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.batch:
+            self.writer.write_table(self.pa.Table.from_pylist(self.batch, schema=self.schema))
+            self.batch = []
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+def _is_parquet(output: str) -> bool:
+    return output.endswith(".parquet")
+
+class _CsvSink:
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8", newline="") if path != "-" else sys.stdout
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row: dict) -> None:
+        self.writer.writerow(row)
+
+    def close(self) -> None:
+        if self.file is not sys.stdout:
+            self.file.close()
+
+def replay(folder: str, output: str, workers: int | None = None, chunksize: int = 64,
+           with_message: bool = False) -> dict[str, int]:
+    """
+    ประมวลผลทุก snapshot ใน folder บน process pool แล้วเขียนผลทีละแถวตามลำดับเวลา
+    (ไม่เก็บผลทั้งหมดไว้ในหน่วยความจำ) คืนค่าจำนวนแถวต่อระดับการเตือน
+    """
+    tasks = collect_snapshots(folder)
+    sink = _ParquetSink(output) if _is_parquet(output) else _CsvSink(output)
+    tiers: dict[str, int] = {}
+    unreadable = 0
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for row in pool.map(partial(evaluate_snapshot, with_message=with_message), tasks, chunksize=chunksize):
+                sink.write(row)
+                tiers[row["tier"]] = tiers.get(row["tier"], 0) + 1
+                unreadable += row["error"] is not None
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - started
+    rate = len(tasks) / elapsed if elapsed > 0 else 0.0
+    print(f"✅ ประมวลผล {len(tasks)} snapshot ใน {elapsed:.2f} วินาที ({rate:,.0f} snapshot/วินาที)", file=sys.stderr)
+    print(f"📊 ระดับการเตือน: {tiers}", file=sys.stderr)
+    if unreadable:
+        print(f"⚠️ อ่านไฟล์ไม่ได้ {unreadable} snapshot (ดูคอลัมน์ error)", file=sys.stderr)
+    return tiers
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="เล่นซ้ำ snapshot ที่เก็บไว้ผ่าน parser และเกณฑ์เตือนภัยปัจจุบัน")
+    cli.add_argument("folder", help="โฟลเดอร์ที่มีไฟล์ singburi_<เวลา>.html/.json และ chaopraya_<เวลา>.*")
+    cli.add_argument("-o", "--output", default="-", help="ไฟล์ผลลัพธ์ .csv หรือ .parquet (ค่าเริ่มต้น: stdout แบบ CSV)")
+    cli.add_argument("-j", "--workers", type=int, default=None, help="จำนวน process (ค่าเริ่มต้น: จำนวน CPU)")
+    cli.add_argument("--chunksize", type=int, default=64, help="จำนวน snapshot ต่องานที่ส่งให้แต่ละ process")
+    cli.add_argument("--messages", action="store_true", help="เก็บข้อความที่บอทจะส่งไว้ในคอลัมน์ message ด้วย")
+    args = cli.parse_args()
+    # ตรวจก่อนเริ่ม process pool เพื่อไม่ให้ประมวลผลไปก่อนแล้วจึงพบว่าเขียนผลไม่ได้
+    if _is_parquet(args.output) and importlib.util.find_spec("pyarrow") is None:
+        cli.error("การเขียน .parquet ต้องติดตั้ง pyarrow ก่อน (pip install pyarrow) หรือใช้ -o ไฟล์.csv แทน")
+    replay(args.folder, args.output, args.workers, args.chunksize, args.messages)